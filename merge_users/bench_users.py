@@ -0,0 +1,424 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# This program benchmarks merge_users.py.  It generates synthetic userdb
+# files of a given size, times each stage of merge_users separately, and
+# saves the results as JSON so that two runs can be compared.
+
+# Author: Dale Farnsworth dale@farnsworth.org
+
+# MIT License
+#
+# Copyright 2018 Dale Farnsworth
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function
+
+import os
+import sys
+import argparse
+import json
+import platform
+import random
+import time
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+import merge_users as mu
+
+benchmarkFormat = 1
+
+standardSizes = [100000, 1000000, 5000000]
+
+firstNames = [word for word in mu.titleCaseWords if len(word) > 2][:600]
+
+lastNames = [
+	"Smith", "Johnson", "Williams", "Brown", "Jones", "Miller", "Davis",
+	"Garcia", "Rodriguez", "Wilson", "Martinez", "Anderson", "Taylor",
+	"Thomas", "Hernandez", "Moore", "Martin", "Jackson", "Thompson",
+	"White", "Lopez", "Lee", "Gonzalez", "Harris", "Clark", "Lewis",
+	"Robinson", "Walker", "Perez", "Hall", "Young", "Allen", "Muller",
+	"Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner",
+	"Becker", "Schulz", "Hoffmann", "Rossi", "Russo", "Ferrari",
+	"Esposito", "Bianchi", "Romano", "Colombo", "Kowalski", "Nowak",
+	"Wisniewski", "De Jong", "Jansen", "De Vries", "Van den Berg",
+	"Tremblay", "Gagnon", "Roy", "Cote", "Bouchard", "Sato", "Suzuki",
+	"Takahashi", "Tanaka", "Silva", "Santos", "Oliveira", "Souza",
+]
+
+cityWords = [
+	"Spring", "Field", "Lake", "River", "Oak", "Pine", "Cedar", "Maple",
+	"Hill", "Valley", "Green", "Fair", "Wood", "Brook", "Mill", "Rock",
+	"Bridge", "Port", "Haven", "Ridge", "Glen", "Stone", "Bay", "Grove",
+	"Burg", "Heim", "Dorf", "Stadt", "Ville", "Mont", "Bois", "Berg",
+]
+
+callPrefixes = ["K", "N", "W", "AA", "AB", "KA", "KB", "VE", "VA", "DL",
+	"DJ", "DK", "PA", "PD", "ON", "SP", "SQ", "IZ", "IK", "JA", "JH",
+	"G", "M", "2E", "VK", "ZL", "PY", "EA", "F", "HB"]
+
+# Country names, weighted roughly like the real database
+def country_choices():
+	countries = sorted(mu.countryAbbrevs)
+	weighted = []
+	for country in countries:
+		weight = 1
+		if country == "United States":
+			weight = 60
+		elif country in mu.stateAbbrevsByCountry:
+			weight = 8
+		weighted += [country] * weight
+	return weighted
+
+# There are about 33000 possible city names
+maxCities = 20000
+
+def make_cities(rng, n):
+	cities = set()
+	while len(cities) < n:
+		city = rng.choice(cityWords) + rng.choice(cityWords).lower()
+		if rng.random() < 0.3:
+			city += " " + rng.choice(cityWords)
+		cities.add(city)
+	return sorted(cities)
+
+def make_call(rng):
+	call = rng.choice(callPrefixes) + str(rng.randint(0, 9))
+	for _ in range(rng.randint(1, 3)):
+		call += chr(ord("A") + rng.randint(0, 25))
+	return call
+
+# Return the fields of a synthetic user, with the casing and formatting
+# quirks that the merge_users transforms are meant to fix.
+def make_user(rng, dmr_id, cities, countries):
+	call = make_call(rng)
+	first = rng.choice(firstNames)
+	last = rng.choice(lastNames)
+	if rng.random() < 0.5:
+		first = first.title()
+	if rng.random() < 0.1:
+		last = last.upper()
+	name = first + " " + last
+
+	r = rng.random()
+	if r < 0.03:
+		name += " " + last
+	elif r < 0.04:
+		name += " " + name
+	elif r < 0.06:
+		name += rng.choice([" Ii", " Iii", " Iv"])
+	elif r < 0.08:
+		name = " " + name.replace(" ", "  ") + " "
+
+	nick = ""
+	r = rng.random()
+	if r < 0.4:
+		nick = first
+	elif r < 0.45:
+		nick = first.title() + " " + call
+
+	country = rng.choice(countries)
+	state = ""
+	states = mu.stateAbbrevsByCountry.get(country)
+	if states:
+		state = rng.choice(sorted(states))
+		r = rng.random()
+		if r < 0.2:
+			state = states[state]
+		elif r < 0.3:
+			state = state.upper()
+
+	r = rng.random()
+	if r < 0.02 and state != "" and country == "United States":
+		country = state
+		state = ""
+	elif r < 0.1:
+		country = country.upper()
+	elif r < 0.5:
+		country = mu.countryAbbrevs[country]
+
+	city = rng.choice(cities)
+	r = rng.random()
+	if r < 0.05:
+		city = rng.choice(sorted(mu.directionAbbrevs)) + " " + city
+	elif r < 0.15:
+		city = city.upper()
+
+	if dmr_id >= 1000000 and rng.random() < 0.01:
+		call = call[:2] + " " + call[2:]
+
+	return [str(dmr_id), call, name, city, state, nick, country]
+
+# Write a userdb file of n records sorted by DMR ID, and an overrides file
+# changing some fields of 10% of them, for merging after the first.
+def generate(dirname, n, seed):
+	rng = random.Random(seed)
+	cities = make_cities(rng, min(maxCities, max(100, n // 50)))
+	countries = country_choices()
+
+	base = os.path.join(dirname, "users_{0}_{1}.csv".format(n, seed))
+	overrides = os.path.join(dirname,
+		"overrides_{0}_{1}.csv".format(n, seed))
+	if os.path.exists(base) and os.path.exists(overrides):
+		return base, overrides
+
+	baseFile = open(base + ".tmp", "w")
+	overrideFile = open(overrides + ".tmp", "w")
+	step = max(1, (mu.maxDMRID - 1000000) // n)
+	dmr_id = 1000000
+	for _ in range(n):
+		dmr_id += rng.randint(1, step)
+		fields = make_user(rng, dmr_id, cities, countries)
+		baseFile.write(",".join(fields) + "\n")
+
+		if rng.random() < 0.1:
+			changed = make_user(rng, dmr_id, cities, countries)
+			fields = [fields[0]] + [field if rng.random() < 0.3 else ""
+				for field in changed[1:]]
+			overrideFile.write(",".join(fields) + "\n")
+
+	baseFile.close()
+	overrideFile.close()
+	os.rename(base + ".tmp", base)
+	os.rename(overrides + ".tmp", overrides)
+	return base, overrides
+
+def peak_rss():
+	if resource == None:
+		return None
+
+	maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform != "darwin":
+		maxrss *= 1024
+	return maxrss
+
+def parse_files(merger, filenames):
+	for filename in filenames:
+		file = open(filename, "r")
+		userFilter = merger.file_filter(filename)
+		i = 1
+		for line in file:
+			mu.parse_user_line(file, i, line, userFilter)
+			i += 1
+		file.close()
+
+# The number of records whose filtering is timed at a time
+filterChunk = 10000
+
+# Return the time taken by the filters of filterMerger to test the
+# records of the files.  The records are parsed by merger, without
+# filter rules, a chunk at a time, outside the timing.
+def time_filters(merger, filterMerger, filenames):
+	seconds = 0.0
+	def time_chunk(accepts, chunk):
+		start = time.time()
+		for dmr_id, country in chunk:
+			accepts(dmr_id, country)
+		return time.time() - start
+
+	for filename in filenames:
+		file = open(filename, "r")
+		userFilter = merger.file_filter(filename)
+		accepts = filterMerger.file_filter(filename).accepts
+		chunk = []
+		i = 1
+		for line in file:
+			parsed = mu.parse_user_line(file, i, line, userFilter)
+			i += 1
+			if parsed != None:
+				chunk.append((parsed[0], parsed[1][6]))
+			if len(chunk) == filterChunk:
+				seconds += time_chunk(accepts, chunk)
+				chunk = []
+		seconds += time_chunk(accepts, chunk)
+		file.close()
+	return seconds
+
+# Return a Merger with a set of exclude rules for the filter stage
+def filter_merger():
+	merger = mu.Merger()
+
+	rng = random.Random(0)
+	idRanges = []
+	for _ in range(1000):
+		lo = rng.randint(1000000, mu.maxDMRID)
+		idRanges.append("{0}-{1}".format(lo, lo + rng.randint(0, 100)))
+	merger.excludeIDRanges("*", idRanges, "")
+	merger.excludeCountries("*", ["Japan", "Brazil"], "")
+	return merger
+
+# Time each stage of merging filenames, returning the best of repeat runs.
+# The field memos are emptied before each run, so that every run starts
+# cold, as merge_users does.
+def run_stages(filenames, repeat):
+	best = {}
+	def record(name, seconds):
+		if name not in best or seconds < best[name]:
+			best[name] = seconds
+
+	devnull = open(os.devnull, "w")
+	for _ in range(repeat):
+		mu.fieldMemos.clear()
+		merger = mu.Merger()
+		for filename in filenames:
+			merger.add_file(open(filename, "r"))
+
+		start = time.time()
+		parse_files(merger, filenames)
+		parse = time.time() - start
+		record("parse", parse)
+
+		record("filter", time_filters(merger, filter_merger(), filenames))
+
+		start = time.time()
+		merger.read_user_files(merger.files)
+		for file in merger.files:
+			file.close()
+		record("merge", time.time() - start - parse)
+
+		start = time.time()
+		merger.massage_users()
+		record("massage", time.time() - start)
+
+		stdout = sys.stdout
+		sys.stdout = devnull
+		start = time.time()
+		try:
+			merger.output_users()
+		finally:
+			sys.stdout = stdout
+		record("output", time.time() - start)
+
+	devnull.close()
+	return best, len(merger.users)
+
+def run(args):
+	if not os.path.isdir(args.dataDir):
+		os.makedirs(args.dataDir)
+
+	results = {
+		"benchmark": benchmarkFormat,
+		"version": mu.version,
+		"python": sys.version.split()[0],
+		"platform": platform.platform(),
+		"seed": args.seed,
+		"repeat": args.repeat,
+		"sizes": [],
+	}
+
+	for n in args.records:
+		print("generating", n, "records", file=sys.stderr)
+		filenames = list(generate(args.dataDir, n, args.seed))
+
+		print("timing", n, "records", file=sys.stderr)
+		stages, userCount = run_stages(filenames, args.repeat)
+		results["sizes"].append({
+			"records": n,
+			"users": userCount,
+			"stages": stages,
+			"peakRSS": peak_rss(),
+		})
+		print_results(results["sizes"][-1])
+
+	if args.output != None:
+		file = open(args.output, "w")
+		json.dump(results, file, indent=1, sort_keys=True)
+		file.write("\n")
+		file.close()
+
+stageNames = ["parse", "filter", "merge", "massage", "output"]
+
+def print_results(size):
+	print("{0} records, peak RSS {1:.1f}M".format(size["records"],
+		(size["peakRSS"] or 0) / (1024.0 * 1024)))
+	for name in stageNames:
+		print("  {0:<10} {1:>9.3f}s".format(name, size["stages"][name]))
+
+def compare(args):
+	results = []
+	for filename in (args.old, args.new):
+		file = open(filename, "r")
+		results.append(json.load(file))
+		file.close()
+
+	old, new = results
+	newSizes = dict((size["records"], size) for size in new["sizes"])
+	for oldSize in old["sizes"]:
+		newSize = newSizes.get(oldSize["records"])
+		if newSize == None:
+			continue
+
+		print("{0} records".format(oldSize["records"]))
+		print("  {0:<10} {1:>10} {2:>10} {3:>8}".format("stage",
+			"old", "new", "new/old"))
+		for name in stageNames:
+			a = oldSize["stages"][name]
+			b = newSize["stages"][name]
+			ratio = "-"
+			if a > 0:
+				ratio = "{0:.2f}".format(b / a)
+			print("  {0:<10} {1:>9.3f}s {2:>9.3f}s {3:>8}".format(
+				name, a, b, ratio))
+
+		a = oldSize["peakRSS"]
+		b = newSize["peakRSS"]
+		if a and b:
+			print("  {0:<10} {1:>9.1f}M {2:>9.1f}M {3:>8.2f}".format(
+				"peakRSS", a / 1048576.0, b / 1048576.0,
+				float(b) / a))
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark merge_users")
+	subparsers = parser.add_subparsers(dest="command")
+
+	runParser = subparsers.add_parser("run",
+		help="Generate userdb files and time merging them.")
+	runParser.add_argument("--records", nargs="+", type=int,
+		default=standardSizes, metavar="N",
+		help="The numbers of records to benchmark. " +
+			"The default is 100000 1000000 5000000.")
+	runParser.add_argument("--seed", type=int, default=1,
+		help="The random seed used to generate the userdb files.")
+	runParser.add_argument("--repeat", type=int, default=3,
+		help="Report the best time of this many runs of each stage.")
+	runParser.add_argument("--dataDir", default="bench_data",
+		metavar="dirname",
+		help="The directory holding the generated userdb files. " +
+			"Existing files are reused.")
+	runParser.add_argument("-o", "--output", metavar="filename",
+		help="Save the results as JSON in filename.")
+
+	compareParser = subparsers.add_parser("compare",
+		help="Compare the results saved by two runs.")
+	compareParser.add_argument("old", metavar="old.json")
+	compareParser.add_argument("new", metavar="new.json")
+
+	args = parser.parse_args()
+
+	if args.command == "run":
+		run(args)
+	elif args.command == "compare":
+		compare(args)
+
+if __name__ == '__main__':
+	main()
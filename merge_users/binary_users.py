@@ -0,0 +1,691 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# This module reads and writes the binary userdb written by
+# merge_users.py --binary.  Run as a program, it converts a binary userdb
+# back to the CSV that merge_users.py writes, verifies that a binary
+# userdb matches such a CSV file, or reports its size against the CSV.
+
+# Author: Dale Farnsworth dale@farnsworth.org
+
+# MIT License
+#
+# Copyright 2018 Dale Farnsworth
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# The binary userdb holds the records in DMR ID order.  All integers are
+# unsigned little-endian, and every table is 4-byte aligned.  In format
+# version 1, all integers are 32-bit:
+#
+#	header		magic "MDUB", format version, record count n,
+#			blob size
+#	ids		n DMR IDs, in ascending order
+#	offsets		n + 1 offsets into the blob.  Record i is the
+#			blob bytes from offsets[i] up to offsets[i+1].
+#	blob		the records, each "call,name,city,state,nick,country"
+#			without its DMR ID or newline
+#
+# Format version 2 stores each distinct city, state and country value
+# once, in a string pool, and the records refer to them by code:
+#
+#	header		as above, followed by the number of pool strings p,
+#			the pool size and the code size, 2 or 4 bytes
+#	ids		as above
+#	offsets		as above
+#	codes		n (city, state, country) triples of pool codes,
+#			padded to a multiple of 4 bytes
+#	poolOffsets	p + 1 offsets into the pool
+#	pool		the pool strings, code i being the bytes from
+#			poolOffsets[i] up to poolOffsets[i+1]
+#	blob		the records, each "call,name,nick"
+#
+# Format version 3 adds an index of the records by call sign, and may or
+# may not pool its strings:
+#
+#	header		as in version 2, with a code size of 0 if the strings
+#			are not pooled, followed by the number of records
+#			with a call sign m
+#	ids		as above
+#	offsets		as above
+#	calls		m record indexes, in the order of the upper-case
+#			call signs of the records, and in DMR ID order for
+#			equal call signs
+#	codes, poolOffsets and pool, as above, if the strings are pooled
+#	blob		as in version 1, or as in version 2 if the strings
+#			are pooled
+#
+# Finding a DMR ID is a binary search of the ids table, and a record's
+# fields are found through the offsets table without reading any other
+# record.  Finding a call sign is a binary search of the calls table.
+# The file is read in place by map_binary, so any number of processes
+# can share one copy of it through the page cache.
+
+from __future__ import print_function
+
+import os
+import sys
+import argparse
+import array
+import mmap
+import shutil
+import struct
+import tempfile
+
+magic = b"MDUB"
+formatVersion = 1
+pooledFormatVersion = 2
+indexedFormatVersion = 3
+
+headerFormat = "<4sIII"
+headerSize = struct.calcsize(headerFormat)
+pooledHeaderFormat = "<4sIIIIII"
+pooledHeaderSize = struct.calcsize(pooledHeaderFormat)
+indexedHeaderFormat = "<4sIIIIIII"
+indexedHeaderSize = struct.calcsize(indexedHeaderFormat)
+
+# The indexes of the pooled fields in "call,name,city,state,nick,country"
+pooledFields = (2, 3, 5)
+
+# The array typecode of an unsigned 32-bit integer
+uint32 = "I"
+if array.array(uint32).itemsize != 4:
+	uint32 = "L"
+
+# Return an array of typecode holding the little-endian integers of data
+def load_array(typecode, data=None):
+	a = array.array(typecode)
+	if data != None:
+		if hasattr(a, "frombytes"):
+			a.frombytes(data)
+		else:
+			a.fromstring(data)
+		if sys.byteorder == "big":
+			a.byteswap()
+	return a
+
+def uint32_array(data=None):
+	return load_array(uint32, data)
+
+def array_bytes(a):
+	if sys.byteorder == "big":
+		a = array.array(a.typecode, a)
+		a.byteswap()
+	if hasattr(a, "tobytes"):
+		return a.tobytes()
+	return a.tostring()
+
+# Write the binary userdb of records, (dmr_id, text) pairs in ascending
+# DMR ID order, where text is the bytes of the record's fields.  If
+# pooled is set, format version 2 is written, and if calls is set,
+# format version 3, pooled or not.  The blob is spooled to a temporary
+# file, since the tables precede it.
+# Returns the number of records and the size of the binary userdb.
+def write_binary(out, records, pooled=False, calls=False):
+	ids = uint32_array()
+	offsets = uint32_array()
+	offsets.append(0)
+	codes = uint32_array()
+	poolCodes = {}
+	pool = []
+	callKeys = []
+	blob = tempfile.TemporaryFile()
+	size = 0
+	for dmr_id, text in records:
+		if len(ids) > 0 and dmr_id <= ids[-1]:
+			raise ValueError("DMR ID {0} follows {1}".format(
+				dmr_id, ids[-1]))
+
+		if calls:
+			call = text.split(b",", 1)[0].upper()
+			if call != b"":
+				callKeys.append((call, len(ids)))
+		ids.append(dmr_id)
+
+		if pooled:
+			fields = text.split(b",")
+			for i in pooledFields:
+				code = poolCodes.get(fields[i])
+				if code is None:
+					code = len(pool)
+					poolCodes[fields[i]] = code
+					pool.append(fields[i])
+				codes.append(code)
+			text = b",".join([fields[0], fields[1], fields[4]])
+
+		blob.write(text)
+		size += len(text)
+		if size > 0xffffffff:
+			raise ValueError("binary userdb blob exceeds 4GB")
+		offsets.append(size)
+
+	tables = [array_bytes(ids), array_bytes(offsets)]
+
+	codeSize = 0
+	poolSize = 0
+	if pooled:
+		poolOffsets = uint32_array()
+		poolOffsets.append(0)
+		for value in pool:
+			poolSize += len(value)
+			poolOffsets.append(poolSize)
+
+		codeSize = 4
+		if len(pool) <= 0x10000:
+			codeSize = 2
+			codes = array.array("H", codes)
+		codeBytes = array_bytes(codes)
+		codeBytes += b"\0" * (-len(codeBytes) % 4)
+		poolTables = [codeBytes, array_bytes(poolOffsets), b"".join(pool)]
+
+	if calls:
+		callKeys.sort()
+		callOrder = uint32_array()
+		callOrder.extend(i for _, i in callKeys)
+		del callKeys
+		header = struct.pack(indexedHeaderFormat, magic,
+			indexedFormatVersion, len(ids), size, len(pool), poolSize,
+			codeSize, len(callOrder))
+		tables.append(array_bytes(callOrder))
+		if pooled:
+			tables += poolTables
+	elif pooled:
+		header = struct.pack(pooledHeaderFormat, magic,
+			pooledFormatVersion, len(ids), size, len(pool), poolSize,
+			codeSize)
+		tables += poolTables
+	else:
+		header = struct.pack(headerFormat, magic, formatVersion,
+			len(ids), size)
+
+	out.write(header)
+	for table in tables:
+		out.write(table)
+	blob.seek(0)
+	shutil.copyfileobj(blob, out, 1024 * 1024)
+	blob.close()
+
+	total = len(header) + sum(len(table) for table in tables) + size
+	return len(ids), total
+
+# A binary userdb held in data, which may be bytes or an mmap, starting
+# at offset and ending at the end of data
+class BinaryUsers(object):
+	def __init__(self, data, offset=0):
+		if len(data) < offset + headerSize:
+			raise ValueError("not a binary userdb: too short")
+
+		fileMagic, version, count, blobSize = struct.unpack_from(
+			headerFormat, data, offset)
+		if fileMagic != magic:
+			raise ValueError("not a binary userdb: bad magic")
+		if version not in (formatVersion, pooledFormatVersion,
+				indexedFormatVersion):
+			raise ValueError("unsupported binary userdb version {0}".format(
+				version))
+
+		self.data = data
+		self.offset = offset
+		self.version = version
+		self.count = count
+		self.idsStart = offset + headerSize
+		self.poolCount = 0
+		poolSize = 0
+		self.codeSize = 0
+		self.callCount = 0
+
+		if version == pooledFormatVersion:
+			if len(data) < offset + pooledHeaderSize:
+				raise ValueError("not a binary userdb: too short")
+			_, _, _, _, self.poolCount, poolSize, self.codeSize = \
+				struct.unpack_from(pooledHeaderFormat, data, offset)
+			self.idsStart = offset + pooledHeaderSize
+			if self.codeSize not in (2, 4):
+				raise ValueError("binary userdb code size {0}".format(
+					self.codeSize))
+		elif version == indexedFormatVersion:
+			if len(data) < offset + indexedHeaderSize:
+				raise ValueError("not a binary userdb: too short")
+			_, _, _, _, self.poolCount, poolSize, self.codeSize, \
+				self.callCount = struct.unpack_from(
+					indexedHeaderFormat, data, offset)
+			self.idsStart = offset + indexedHeaderSize
+			if self.codeSize not in (0, 2, 4):
+				raise ValueError("binary userdb code size {0}".format(
+					self.codeSize))
+
+		self.pooled = self.codeSize != 0
+		self.offsetsStart = self.idsStart + 4 * count
+		self.callsStart = self.offsetsStart + 4 * (count + 1)
+		self.codesStart = self.callsStart + 4 * self.callCount
+		self.blobStart = self.codesStart
+
+		if self.pooled:
+			self.codeFormat = "<3" + {2: "H", 4: "I"}[self.codeSize]
+			codesSize = 3 * self.codeSize * count
+			self.poolOffsetsStart = self.codesStart + codesSize + \
+				(-codesSize % 4)
+			self.poolStart = self.poolOffsetsStart + \
+				4 * (self.poolCount + 1)
+			self.blobStart = self.poolStart + poolSize
+
+		if len(data) != self.blobStart + blobSize:
+			raise ValueError("binary userdb size {0}, expected {1}".format(
+				len(data), self.blobStart + blobSize))
+
+	def __len__(self):
+		return self.count
+
+	# Unmap data if it was mapped by map_binary
+	def close(self):
+		if isinstance(self.data, mmap.mmap):
+			self.data.close()
+
+	def id(self, i):
+		return struct.unpack_from("<I", self.data, self.idsStart + 4 * i)[0]
+
+	# Return pool string code
+	def pool_string(self, code):
+		start, end = struct.unpack_from("<II", self.data,
+			self.poolOffsetsStart + 4 * code)
+		return self.data[self.poolStart+start:self.poolStart+end]
+
+	# Return the array of the (city, state, country) codes of all records
+	def codes(self):
+		codesEnd = self.codesStart + 3 * self.codeSize * self.count
+		typecode = uint32
+		if self.codeSize == 2:
+			typecode = "H"
+		return load_array(typecode, self.data[self.codesStart:codesEnd])
+
+	# Return the pool strings of all codes
+	def pool_strings(self):
+		offsets = uint32_array(
+			self.data[self.poolOffsetsStart:self.poolStart])
+		return [self.data[self.poolStart+offsets[i]:
+			self.poolStart+offsets[i+1]]
+			for i in range(self.poolCount)]
+
+	# Return the bytes of the fields of record i
+	def text(self, i):
+		start, end = struct.unpack_from("<II", self.data,
+			self.offsetsStart + 4 * i)
+		text = self.data[self.blobStart+start:self.blobStart+end]
+		if not self.pooled:
+			return text
+
+		city, state, country = struct.unpack_from(self.codeFormat,
+			self.data, self.codesStart + 3 * self.codeSize * i)
+		call, name, nick = text.split(b",")
+		return b",".join([call, name, self.pool_string(city),
+			self.pool_string(state), nick, self.pool_string(country)])
+
+	# Return the index of the record of dmr_id, or None
+	def find(self, dmr_id):
+		lo = 0
+		hi = self.count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self.id(mid) < dmr_id:
+				lo = mid + 1
+			else:
+				hi = mid
+
+		if lo < self.count and self.id(lo) == dmr_id:
+			return lo
+		return None
+
+	# Return the list of field bytes of dmr_id, without the DMR ID itself,
+	# or None
+	def lookup(self, dmr_id):
+		i = self.find(dmr_id)
+		if i == None:
+			return None
+		return self.text(i).split(b",")
+
+	# Return the bytes of the call sign of record i.  Only the call sign
+	# is copied out of data.
+	def call(self, i):
+		start, end = struct.unpack_from("<II", self.data,
+			self.offsetsStart + 4 * i)
+		start += self.blobStart
+		end = self.data.find(b",", start, self.blobStart + end)
+		return self.data[start:end]
+
+	# Return the index of the record of the k-th call sign in the calls
+	# table
+	def call_record(self, k):
+		return struct.unpack_from("<I", self.data,
+			self.callsStart + 4 * k)[0]
+
+	# Return the indexes of the records of call, which is matched
+	# ignoring case, in DMR ID order.  If prefix is set, the records of
+	# every call sign starting with call are returned, in call sign
+	# order.
+	def find_call(self, call, prefix=False):
+		if self.version != indexedFormatVersion:
+			raise ValueError("binary userdb has no call sign index")
+
+		key = call.upper()
+		if key == b"" and not prefix:
+			return []
+		lo = 0
+		hi = self.callCount
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self.call(self.call_record(mid)).upper() < key:
+				lo = mid + 1
+			else:
+				hi = mid
+
+		found = []
+		while lo < self.callCount:
+			i = self.call_record(lo)
+			recordCall = self.call(i).upper()
+			if recordCall != key and not (prefix and
+					recordCall.startswith(key)):
+				break
+			found.append(i)
+			lo += 1
+		return found
+
+	# Return the (dmr_id, fields) of the records of call, as find_call
+	def lookup_call(self, call, prefix=False):
+		return [(self.id(i), self.text(i).split(b","))
+			for i in self.find_call(call, prefix)]
+
+	# Yield the (dmr_id, text) of every record, in DMR ID order
+	def records(self):
+		ids = uint32_array(self.data[self.idsStart:self.offsetsStart])
+		offsets = uint32_array(self.data[self.offsetsStart:
+			self.offsetsStart+4*(self.count+1)])
+		blobStart = self.blobStart
+		if not self.pooled:
+			for i, dmr_id in enumerate(ids):
+				yield dmr_id, self.data[blobStart+offsets[i]:
+					blobStart+offsets[i+1]]
+			return
+
+		codes = self.codes()
+		pool = self.pool_strings()
+		for i, dmr_id in enumerate(ids):
+			call, name, nick = self.data[blobStart+offsets[i]:
+				blobStart+offsets[i+1]].split(b",")
+			yield dmr_id, b",".join([call, name, pool[codes[3*i]],
+				pool[codes[3*i+1]], nick, pool[codes[3*i+2]]])
+
+	# Yield the lines of the CSV output of merge_users.py, prefixed by
+	# their byte count if header is set
+	def csv_lines(self, header=True):
+		if header and self.count > 0:
+			byteCount = self.csv_size(False)
+			yield str(byteCount).encode("ascii") + b"\n"
+
+		for dmr_id, text in self.records():
+			yield str(dmr_id).encode("ascii") + b"," + text + b"\n"
+
+	# Return the size of the CSV output of merge_users.py
+	def csv_size(self, header=True):
+		byteCount = 0
+		for dmr_id, text in self.records():
+			byteCount += len(str(dmr_id)) + len(text) + 2
+		if header and self.count > 0:
+			byteCount += len(str(byteCount)) + 1
+		return byteCount
+
+	# Return a list of the problems found in the tables
+	def check(self):
+		problems = []
+		ids = uint32_array(self.data[self.idsStart:self.offsetsStart])
+		offsets = uint32_array(self.data[self.offsetsStart:
+			self.offsetsStart+4*(self.count+1)])
+		blobSize = len(self.data) - self.blobStart
+
+		for i in range(1, self.count):
+			if ids[i] <= ids[i-1]:
+				problems.append("DMR ID {0} follows {1}".format(
+					ids[i], ids[i-1]))
+		for i in range(self.count):
+			if offsets[i+1] < offsets[i]:
+				problems.append("DMR ID {0} has a negative size".format(
+					ids[i]))
+		if offsets[self.count] != blobSize:
+			problems.append("records hold {0} of {1} blob bytes".format(
+				offsets[self.count], blobSize))
+
+		if self.callCount > 0:
+			calls = uint32_array(self.data[self.callsStart:
+				self.codesStart])
+			if max(calls) >= self.count:
+				problems.append("call sign index of record {0} of " \
+					"{1}".format(max(calls), self.count))
+			elif len(set(calls)) != len(calls):
+				problems.append("call sign index repeats records")
+			else:
+				prev = (b"", -1)
+				for i in calls:
+					key = (self.call(i).upper(), i)
+					if key[0] == b"" or key < prev:
+						problems.append("call sign index out of " \
+							"order at DMR ID {0}".format(ids[i]))
+						break
+					prev = key
+
+		commas = 5
+		if self.pooled:
+			commas = 2
+			codes = self.codes()
+			if len(codes) > 0 and max(codes) >= self.poolCount:
+				problems.append("pool code {0} of {1} strings".format(
+					max(codes), self.poolCount))
+			poolOffsets = uint32_array(
+				self.data[self.poolOffsetsStart:self.poolStart])
+			if poolOffsets[self.poolCount] != \
+					self.blobStart - self.poolStart:
+				problems.append("pool strings hold {0} of {1} bytes".format(
+					poolOffsets[self.poolCount],
+					self.blobStart - self.poolStart))
+
+		if len(problems) > 0:
+			return problems
+
+		for i in range(self.count):
+			text = self.data[self.blobStart+offsets[i]:
+				self.blobStart+offsets[i+1]]
+			if text.count(b",") != commas:
+				problems.append("DMR ID {0} has {1} fields".format(
+					ids[i], text.count(b",") + 1))
+		return problems
+
+# Describe the size of a binary userdb against that of the CSV output
+def size_report(count, size, csvSize):
+	ratio = 0.0
+	if size > 0:
+		ratio = float(csvSize) / size
+	return "{0} records in {1} bytes, {2} bytes as CSV, " \
+		"compression ratio {3:.2f}".format(count, size, csvSize, ratio)
+
+def read_binary(filename):
+	file = open(filename, "rb")
+	try:
+		data = file.read()
+	finally:
+		file.close()
+	return BinaryUsers(data)
+
+# Map the binary userdb filename read-only into memory.  Nothing is read
+# until it is looked up, and only the pages a lookup touches are read.
+# Any number of processes can map the same file and share its pages
+# through the page cache.  A file replaced by merge_users.py --output
+# is renamed into place, so a reader keeps the old records until it maps
+# the file again.  The binary userdb starts at offset in the file.
+def map_binary(filename, offset=0):
+	file = open(filename, "rb")
+	try:
+		if os.fstat(file.fileno()).st_size < offset + headerSize:
+			raise ValueError("{0}: not a binary userdb: too short".format(
+				filename))
+		data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+	finally:
+		file.close()
+	return BinaryUsers(data, offset)
+
+def binary_stdout():
+	return getattr(sys.stdout, "buffer", sys.stdout)
+
+def csv_command(args):
+	users = map_binary(args.binary)
+	out = binary_stdout()
+	if args.output != None:
+		out = open(args.output, "wb")
+
+	for line in users.csv_lines(args.header):
+		out.write(line)
+	out.flush()
+	if args.output != None:
+		out.close()
+
+def stats_command(args):
+	users = map_binary(args.binary)
+	print("{0}: format version {1}, {2}".format(args.binary, users.version,
+		size_report(len(users), len(users.data) - users.offset,
+		users.csv_size())))
+	if users.pooled:
+		print("{0}: {1} pooled strings, {2}-byte codes".format(
+			args.binary, users.poolCount, users.codeSize))
+	if users.version == indexedFormatVersion:
+		print("{0}: {1} records indexed by call sign".format(
+			args.binary, users.callCount))
+
+# Print the CSV lines of the records of each DMR ID or call sign
+def lookup_command(args):
+	users = map_binary(args.binary)
+	out = binary_stdout()
+	missing = False
+	for key in args.keys:
+		if key.isdigit():
+			dmr_id = int(key)
+			fields = users.lookup(dmr_id)
+			found = []
+			if fields != None:
+				found.append((dmr_id, fields))
+		else:
+			found = users.lookup_call(key.encode("ascii", "replace"),
+				args.prefix)
+
+		if len(found) == 0:
+			print("{0}: {1} not found".format(args.binary, key),
+				file=sys.stderr)
+			missing = True
+		for dmr_id, fields in found:
+			out.write(str(dmr_id).encode("ascii") + b"," +
+				b",".join(fields) + b"\n")
+	out.flush()
+	users.close()
+	if missing:
+		sys.exit(1)
+
+# Compare the CSV of a binary userdb with a CSV file written by
+# merge_users.py.  The CSV file has a header if its first line is a
+# single number.
+def verify_command(args):
+	users = map_binary(args.binary)
+	problems = users.check()
+	for problem in problems:
+		print("{0}: {1}".format(args.binary, problem), file=sys.stderr)
+	if len(problems) > 0:
+		sys.exit(1)
+
+	file = open(args.csv, "rb")
+	first = file.readline()
+	file.seek(0)
+	header = first.strip().isdigit()
+
+	i = 1
+	for line in users.csv_lines(header):
+		csvLine = file.readline()
+		if csvLine != line:
+			print("{0}:{1}: differs from {2}".format(args.csv, i,
+				args.binary), file=sys.stderr)
+			sys.exit(1)
+		i += 1
+
+	if file.readline() != b"":
+		print("{0}:{1}: not in {2}".format(args.csv, i, args.binary),
+			file=sys.stderr)
+		sys.exit(1)
+	file.close()
+
+	print("{0}: {1} records match {2}".format(args.binary, len(users),
+		args.csv), file=sys.stderr)
+
+def main():
+	parser = argparse.ArgumentParser(
+		description="Read binary userdb files")
+	subparsers = parser.add_subparsers(dest="command")
+
+	csvParser = subparsers.add_parser("csv",
+		help="Convert a binary userdb to the CSV of merge_users.py.")
+	csvParser.add_argument("binary", metavar="binaryfile")
+	csvParser.add_argument("-o", "--output", metavar="filename",
+		help="Write the CSV to filename instead of stdout.")
+	csvParser.add_argument("--noHeader", dest="header",
+		action="store_false",
+		help="Do not prefix the CSV with its byte count.")
+
+	verifyParser = subparsers.add_parser("verify",
+		help="Check a binary userdb against a CSV written by " +
+			"merge_users.py.")
+	verifyParser.add_argument("binary", metavar="binaryfile")
+	verifyParser.add_argument("csv", metavar="csvfile")
+
+	statsParser = subparsers.add_parser("stats",
+		help="Report the size of a binary userdb against that of " +
+			"its CSV.")
+	statsParser.add_argument("binary", metavar="binaryfile")
+
+	lookupParser = subparsers.add_parser("lookup",
+		help="Print the records of DMR IDs or call signs.")
+	lookupParser.add_argument("binary", metavar="binaryfile")
+	lookupParser.add_argument("keys", nargs="+", metavar="id|call",
+		help="A DMR ID, or a call sign, which needs a binary userdb " +
+			"written by merge_users.py --binaryCalls.")
+	lookupParser.add_argument("--prefix", action="store_true",
+		help="Print the records of all call signs starting with call.")
+
+	args = parser.parse_args()
+
+	try:
+		if args.command == "csv":
+			csv_command(args)
+		elif args.command == "verify":
+			verify_command(args)
+		elif args.command == "stats":
+			stats_command(args)
+		elif args.command == "lookup":
+			lookup_command(args)
+		else:
+			parser.print_usage(sys.stderr)
+			sys.exit(1)
+	except (IOError, ValueError) as err:
+		print(err, file=sys.stderr)
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# This program measures the latency and throughput of merge_users.py
+# serve.  It sends lookups of the DMR IDs and call signs of a userdb file
+# from a number of client processes, each over one kept-alive
+# connection, and reports the requests per second and the distribution
+# of the request latencies.
+
+# Author: Dale Farnsworth dale@farnsworth.org
+
+# MIT License
+#
+# Copyright 2018 Dale Farnsworth
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function
+
+import sys
+import argparse
+import json
+import multiprocessing
+import random
+import socket
+import time
+
+try:
+	import httplib as http_client
+	from urllib import quote
+except ImportError:
+	import http.client as http_client
+	from urllib.parse import quote
+
+import merge_users as mu
+
+clock = getattr(time, "perf_counter", time.time)
+
+class UnixHTTPConnection(http_client.HTTPConnection):
+	def __init__(self, socketPath, timeout):
+		http_client.HTTPConnection.__init__(self, "localhost",
+			timeout=timeout)
+		self.socketPath = socketPath
+
+	def connect(self):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.settimeout(self.timeout)
+		self.sock.connect(self.socketPath)
+
+def connection(address, timeout):
+	address = mu.listen_address(address)
+	if isinstance(address, tuple):
+		return http_client.HTTPConnection(address[0], address[1],
+			timeout=timeout)
+	return UnixHTTPConnection(address, timeout)
+
+# Return the request paths: lookups of the DMR IDs and call signs of the
+# records of filename, callFraction of them by call sign
+def request_paths(filename, n, callFraction, seed):
+	ids = []
+	calls = []
+	file = open(filename, "rb")
+	for line in file:
+		fields = line.rstrip(b"\n").split(b",")
+		if len(fields) < 2:
+			continue
+		ids.append(fields[0].decode("ascii", "replace"))
+		if fields[1]:
+			calls.append(quote(fields[1], safe=""))
+	file.close()
+
+	if len(ids) == 0:
+		return []
+
+	rng = random.Random(seed)
+	paths = []
+	for _ in range(n):
+		if calls and rng.random() < callFraction:
+			paths.append("/call/" + rng.choice(calls))
+		else:
+			paths.append("/id/" + rng.choice(ids))
+	return paths
+
+# Send the requests of a client over one connection.  Returns the
+# latency of each request, and the counts of replies by status code.
+def run_client(task):
+	address, timeout, paths = task
+	conn = connection(address, timeout)
+	latencies = []
+	statuses = {}
+	for path in paths:
+		start = clock()
+		try:
+			conn.request("GET", path)
+			response = conn.getresponse()
+			response.read()
+			status = response.status
+		except (IOError, OSError, http_client.HTTPException):
+			conn.close()
+			conn = connection(address, timeout)
+			status = "error"
+		latencies.append(clock() - start)
+		statuses[status] = statuses.get(status, 0) + 1
+	conn.close()
+	return latencies, statuses
+
+def percentile(values, fraction):
+	return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+	parser = argparse.ArgumentParser(description="Measure the " +
+		"latency and throughput of merge_users.py serve")
+
+	parser.add_argument("userdb", metavar="filename",
+		help="A userdb file whose DMR IDs and call signs are looked up.")
+	parser.add_argument("--listen", metavar="address",
+		default=mu.defaultListen,
+		help="The address of the server, host:port or the path of a " +
+			"Unix socket. The default is " + mu.defaultListen + ".")
+	parser.add_argument("--requests", type=int, default=100000,
+		metavar="N", help="Send N requests in all. " +
+			"The default is 100000.")
+	parser.add_argument("--clients", type=int, default=4, metavar="N",
+		help="Send the requests from N client processes at once. " +
+			"The default is 4.")
+	parser.add_argument("--callFraction", type=float, default=0.2,
+		metavar="F", help="Look up this fraction of the records by " +
+			"call sign, the others by DMR ID. The default is 0.2.")
+	parser.add_argument("--seed", type=int, default=1,
+		help="The random seed used to choose the records.")
+	parser.add_argument("--timeout", type=float, default=10,
+		metavar="seconds", help="The timeout of each request.")
+	parser.add_argument("-o", "--output", metavar="filename",
+		help="Save the results as JSON in filename.")
+
+	args = parser.parse_args()
+
+	paths = request_paths(args.userdb, args.requests, args.callFraction,
+		args.seed)
+	if len(paths) == 0:
+		print("{0}: no records".format(args.userdb), file=sys.stderr)
+		sys.exit(1)
+
+	clients = max(1, args.clients)
+	tasks = [(args.listen, args.timeout, paths[k::clients])
+		for k in range(clients)]
+
+	pool = multiprocessing.Pool(clients)
+	start = time.time()
+	results = pool.map(run_client, tasks)
+	wall = time.time() - start
+	pool.close()
+	pool.join()
+
+	latencies = sorted(latency
+		for clientLatencies, _ in results
+		for latency in clientLatencies)
+	statuses = {}
+	for _, clientStatuses in results:
+		for status, count in clientStatuses.items():
+			statuses[str(status)] = statuses.get(str(status), 0) + count
+
+	summary = {
+		"requests": len(latencies),
+		"clients": clients,
+		"wall": wall,
+		"qps": len(latencies) / wall,
+		"statuses": statuses,
+		"latency": {
+			"mean": sum(latencies) / len(latencies),
+			"p50": percentile(latencies, 0.50),
+			"p90": percentile(latencies, 0.90),
+			"p99": percentile(latencies, 0.99),
+			"max": latencies[-1],
+		},
+	}
+
+	print("{0} requests from {1} clients in {2:.3f}s: {3:.0f} requests/s".format(
+		summary["requests"], clients, wall, summary["qps"]))
+	print("  replies  " + ", ".join("{0}: {1}".format(status, count)
+		for status, count in sorted(statuses.items())))
+	for name in ["mean", "p50", "p90", "p99", "max"]:
+		print("  {0:<8} {1:>9.3f}ms".format(name,
+			summary["latency"][name] * 1000))
+
+	if args.output != None:
+		file = open(args.output, "w")
+		json.dump(summary, file, indent=1, sort_keys=True)
+		file.write("\n")
+		file.close()
+
+if __name__ == '__main__':
+	main()
@@ -36,9 +36,306 @@
 
 from __future__ import print_function
 
+import os
 import sys
 import argparse
+import bisect
+import bz2
+import heapq
+import io
+import json
+import marshal
+import multiprocessing
 import shlex
+import stat
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+
+try:
+	import BaseHTTPServer as http_server
+	import SocketServer as socketserver
+	from urllib import unquote
+except ImportError:
+	import http.server as http_server
+	import socketserver
+	from urllib.parse import unquote_to_bytes as unquote
+
+try:
+	intern
+except NameError:
+	from sys import intern
+
+import binary_users
+
+# The files are processed as bytes: fields are only split on commas and
+# compared with ASCII tables, so they are never decoded.  Python 2 reads
+# them as str.  Python 3 maps each byte to one character, non-ASCII
+# bytes to the surrogateescape code points, so that lengths are byte
+# counts, case conversions change only ASCII letters as on Python 2, and
+# the bytes are written back unchanged.  The mapping is done by the io
+# layer a buffer at a time, not per line.
+if sys.version_info[0] < 3:
+	def open_text(name, mode="r", buffering=-1):
+		if isinstance(name, int):
+			return os.fdopen(name, mode, buffering)
+		return open(name, mode, buffering)
+
+	def text_file(file):
+		return file
+
+	def std_file(file):
+		return file
+
+	def arg_string(arg):
+		return arg
+
+	def to_bytes(s):
+		return s
+
+	def from_bytes(b):
+		return b
+
+	def url_string(path):
+		return unquote(path)
+
+	def iteritems(d):
+		return d.iteritems()
+
+	def itervalues(d):
+		return d.itervalues()
+else:
+	def open_text(name, mode="r", buffering=-1):
+		return io.open(name, mode, buffering, encoding="ascii",
+			errors="surrogateescape", newline="\n")
+
+	# Read or write the binary file in the same way as open_text
+	def text_file(file):
+		return io.TextIOWrapper(file, encoding="ascii",
+			errors="surrogateescape", newline="\n")
+
+	# Reopen stdin, stdout or stderr in the same way as open_text
+	def std_file(file):
+		buffering = -1
+		if file.line_buffering:
+			buffering = 1
+		file.flush()
+		stdFile = io.open(file.fileno(), file.mode, buffering,
+			encoding="ascii", errors="surrogateescape",
+			newline="\n", closefd=False)
+
+		# Keep the name, such as <stdin>, rather than the descriptor
+		stdFile.buffer.raw.name = file.name
+		return stdFile
+
+	# Command line arguments are decoded by the interpreter
+	def arg_string(arg):
+		return os.fsencode(arg).decode("ascii", "surrogateescape")
+
+	def to_bytes(s):
+		return s.encode("ascii", "surrogateescape")
+
+	def from_bytes(b):
+		return b.decode("ascii", "surrogateescape")
+
+	# Undo the %-escapes of a URL path, giving the bytes they stand for
+	def url_string(path):
+		return unquote(path).decode("ascii", "surrogateescape")
+
+	def iteritems(d):
+		return iter(d.items())
+
+	def itervalues(d):
+		return iter(d.values())
+
+# Compressed files are recognized by their magic bytes when read, or by
+# their extension if they can't be sniffed (a pipe, say), and by their
+# extension when written.  They are decompressed and compressed a block
+# at a time as they are read and written.
+compressions = [
+	# (compression, extension, magic bytes)
+	("gzip", ".gz", b"\x1f\x8b"),
+	("bzip2", ".bz2", b"BZh"),
+	("xz", ".xz", b"\xfd7zXZ\x00"),
+]
+
+compressedBlockSize = 256 * 1024
+
+def extension_compression(name):
+	for compression, extension, _ in compressions:
+		if name.endswith(extension):
+			return compression
+	return None
+
+def input_compression(name):
+	if not os.path.isfile(name):
+		return extension_compression(name)
+
+	file = open(name, "rb")
+	magic = file.read(6)
+	file.close()
+	for compression, _, prefix in compressions:
+		if magic.startswith(prefix):
+			return compression
+	return None
+
+def new_compressor(compression):
+	if compression == "gzip":
+		return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	if compression == "bzip2":
+		return bz2.BZ2Compressor()
+	return lzma.LZMACompressor()
+
+def new_decompressor(compression):
+	if compression == "gzip":
+		return zlib.decompressobj(16 + zlib.MAX_WBITS)
+	if compression == "bzip2":
+		return bz2.BZ2Decompressor()
+	return lzma.LZMADecompressor()
+
+# The exceptions raised by decompressors given corrupt data
+decompressErrors = (IOError, EOFError, zlib.error)
+if lzma != None:
+	decompressErrors += (lzma.LZMAError,)
+
+# The decompressed contents of the binary file raw.  Concatenated
+# compressed streams, as written by "cat a.gz b.gz", are read in turn.
+class DecompressedFile(io.RawIOBase):
+	def __init__(self, raw, compression):
+		self.raw = raw
+		self.name = raw.name
+		self.compression = compression
+		self.decompressor = new_decompressor(compression)
+		self.pending = b""
+		self.offset = 0
+
+	def readable(self):
+		return True
+
+	def decompress(self, data):
+		blocks = []
+		while data:
+			try:
+				blocks.append(self.decompressor.decompress(data))
+			except EOFError:
+				self.decompressor = new_decompressor(self.compression)
+				continue
+			data = self.decompressor.unused_data
+			if data:
+				self.decompressor = new_decompressor(self.compression)
+		return b"".join(blocks)
+
+	# Return whether the decompressor has reached the end of its stream.
+	# Python 2 decompressors have no eof attribute, but past the end of
+	# the stream bz2 refuses more data and zlib returns it as unused_data.
+	def stream_ended(self):
+		eof = getattr(self.decompressor, "eof", None)
+		if eof != None:
+			return eof
+
+		try:
+			self.decompressor.decompress(b"\0")
+		except EOFError:
+			return True
+		except decompressErrors:
+			return False
+		return len(self.decompressor.unused_data) > 0
+
+	def readinto(self, b):
+		while self.offset >= len(self.pending):
+			data = self.raw.read(compressedBlockSize)
+			if not data:
+				if not self.stream_ended():
+					raise IOError("{0}: truncated {1} file".format(
+						self.name, self.compression))
+				return 0
+			try:
+				self.pending = self.decompress(data)
+			except decompressErrors as err:
+				raise IOError("{0}: corrupt {1} file: {2}".format(
+					self.name, self.compression, err))
+			self.offset = 0
+
+		n = min(len(b), len(self.pending) - self.offset)
+		b[:n] = self.pending[self.offset:self.offset+n]
+		self.offset += n
+		return n
+
+	def close(self):
+		if not self.closed:
+			self.raw.close()
+		io.RawIOBase.close(self)
+
+# Compress what is written to it into the binary file raw
+class CompressedFile(io.RawIOBase):
+	def __init__(self, raw, compression):
+		self.raw = raw
+		self.name = raw.name
+		self.compressor = new_compressor(compression)
+
+	def writable(self):
+		return True
+
+	def write(self, b):
+		self.raw.write(self.compressor.compress(memoryview(b).tobytes()))
+		return len(b)
+
+	def close(self):
+		if not self.closed:
+			self.raw.write(self.compressor.flush())
+			self.raw.close()
+		io.RawIOBase.close(self)
+
+# Open a file, decompressing or compressing it as needed.  The file is
+# read and written as text, as described above, unless the mode is
+# binary.  Compressed input is recognized by input_compression; output
+# is compressed if compression is given.
+def open_file(name, mode="r", buffering=-1, compression=None):
+	if "r" in mode and not isinstance(name, int):
+		compression = input_compression(name)
+
+	if compression == None:
+		if "b" in mode:
+			return io.open(name, mode, buffering)
+		return open_text(name, mode, buffering)
+
+	if compression == "xz" and lzma == None:
+		raise IOError("xz files need the lzma module")
+
+	if buffering <= 1:
+		buffering = compressedBlockSize
+
+	raw = io.open(name, mode.replace("b", "") + "b")
+	if "r" in mode:
+		file = io.BufferedReader(DecompressedFile(raw, compression),
+			buffering)
+	else:
+		file = io.BufferedWriter(CompressedFile(raw, compression),
+			buffering)
+
+	if "b" in mode:
+		return file
+	return text_file(file)
 
 version = "1.0.3"
 
@@ -2252,26 +2549,189 @@ def upperFirst(x):
 def lowerFirst(x):
     return x[0].lower() + x[1:]
 
-enable_options = [upperFirst(x["name"]) for x in sorted(optionList)]
+enable_options = [upperFirst(name)
+	for name in sorted(x["name"] for x in optionList)]
 disable_options = ["No" + x for x in enable_options]
 
 titleCaseDict = {word : word.title() for word in titleCaseWords}
+upperCaseDict = {word : True for word in upperCaseWords}
+
+# The country of each state name.  A state name found in more than one
+# country (Limburg) maps to the first of them in stateAbbrevsByCountry.
+def state_countries():
+	countries = {}
+	for country, abbrevStates in iteritems(stateAbbrevsByCountry):
+		for state in abbrevStates:
+			countries.setdefault(state, country)
+	return countries
+
+stateCountries = state_countries()
 
 stateAbbrevs = {}
 stateAbbrevsInverse = {}
 countryAbbrevsInverse = {}
 
-varbose = False
-options = {}
-files = []
-verbatim = []
-excludedIDRanges = {}
-includedIDRanges = {}
-excludedCountries = {}
-includedCountries = {}
-errors = []
+# Fill in stateAbbrevs and the inverse tables, and add the upper-case
+# names to countryAbbrevs.  The tables are built once, when the module is
+# loaded, and shared by every Merger.
+def init_abbrevs():
+	for _, abbrevStates in iteritems(stateAbbrevsByCountry):
+		stateAbbrevs.update(abbrevStates)
+
+	for state, abbrev in list(stateAbbrevs.items()):
+		stateAbbrevs[state.upper()] = abbrev
+		existing = stateAbbrevsInverse.get(abbrev.upper(), "")
+		if existing != "":
+			print("Error: duplicate abbreviation:", abbrev,
+				file=sys.stderr)
+		stateAbbrevsInverse[abbrev.upper()] = state
 
-users = {}
+	for _, abbrevStates in iteritems(alternateStateAbbrevsByCountry):
+		for state, abbrev in abbrevStates.items():
+			stateAbbrevs[state.upper()] = abbrev
+
+	for country, abbrev in list(countryAbbrevs.items()):
+		countryAbbrevs[country.upper()] = abbrev
+		existing = countryAbbrevsInverse.get(abbrev.upper(), "")
+		if existing != "":
+			print("Error: duplicate abbreviation:", abbrev,
+				file=sys.stderr)
+		countryAbbrevsInverse[abbrev.upper()] = country
+
+	for country, abbrev in alternateCountryAbbrevs.items():
+		countryAbbrevs[country.upper()] = abbrev
+
+	for abbrev, country in inverseCountryAbbrevs.items():
+		countryAbbrevsInverse[abbrev.upper()] = country
+
+init_abbrevs()
+
+# The order of the fields in a userdb line
+userFields = ("id", "call", "name", "city", "state", "nick", "country")
+
+# A single merged userdb record.  Records are kept in __slots__ objects
+# rather than dicts: on a 64-bit python2 a User costs 104 bytes (plus its
+# strings), where the equivalent 7-key dict costs 664 bytes.  The target
+# is to stay at or below 128 bytes per record, excluding the field strings
+# themselves and the int key in users.
+#
+# The city, state and country values repeat heavily, so they are interned:
+# all records with the same value share a single string.
+class User(object):
+	__slots__ = userFields
+
+	def __init__(self, dmr_id, call="", name="", city="", state="",
+			nick="", country=""):
+		self.id = dmr_id
+		self.call = call
+		self.name = name
+		self.city = intern(city)
+		self.state = intern(state)
+		self.nick = nick
+		self.country = intern(country)
+
+	# Non-empty fields replace the existing fields.
+	# Returns True if any field was replaced.
+	def merge(self, call, name, city, state, nick, country):
+		changed = False
+		if call != "":
+			self.call = call
+			changed = True
+		if name != "":
+			self.name = name
+			changed = True
+		if city != "":
+			self.city = intern(city)
+			changed = True
+		if state != "":
+			self.state = intern(state)
+			changed = True
+		if nick != "":
+			self.nick = nick
+			changed = True
+		if country != "":
+			self.country = intern(country)
+			changed = True
+		return changed
+
+	def fields(self):
+		return (self.id, self.call, self.name, self.city, self.state,
+			self.nick, self.country)
+
+	def set_fields(self, fields):
+		(self.id, self.call, self.name, city, state, self.nick,
+			country) = fields
+		self.city = intern(city)
+		self.state = intern(state)
+		self.country = intern(country)
+
+	# The length of line(), plus its newline
+	def line_length(self):
+		return (len(self.id) + len(self.call) + len(self.name) +
+			len(self.city) + len(self.state) + len(self.nick) +
+			len(self.country) + 7)
+
+	def line(self):
+		return "{0},{1},{2},{3},{4},{5},{6}".format(self.id, self.call,
+			self.name, self.city, self.state, self.nick, self.country)
+
+maxDMRID = 16777215
+
+# Return the (dmr_id, user) pairs of users, which maps the integer DMR ID
+# to its User record, in DMR ID order.  Sorting the IDs is cheaper than
+# keeping the users in a table indexed by DMR ID, whose walk needs no
+# sort: such a table made reading and output slower on Python 2.7 and
+# 3.11, since each of its accesses is a Python method call.
+def sorted_users(users):
+	return ((dmr_id, users[dmr_id]) for dmr_id in sorted(users))
+
+# CallIndex maps the upper-case call signs of the users to their DMR IDs.
+# One call sign often has several DMR IDs.  The call signs are also kept
+# in a sorted list, so the call signs with a prefix are found by bisect.
+class CallIndex(object):
+	# Index the (dmr_id, user) pairs of users, in DMR ID order
+	def __init__(self, users):
+		self.ids = {}
+		for dmr_id, user in users:
+			if user.call == "":
+				continue
+			call = user.call.upper()
+			ids = self.ids.get(call)
+			if ids is None:
+				self.ids[call] = [dmr_id]
+			else:
+				ids.append(dmr_id)
+		self.calls = sorted(self.ids)
+
+	def __len__(self):
+		return len(self.calls)
+
+	# Return the DMR IDs of call, in ID order
+	def lookup(self, call):
+		return self.ids.get(call.upper(), [])
+
+	# Return the (call, dmr_ids) of the call signs starting with prefix,
+	# in call sign order, at most limit of them if limit is given
+	def prefix(self, prefix, limit=None):
+		prefix = prefix.upper()
+		found = []
+		i = bisect.bisect_left(self.calls, prefix)
+		while i < len(self.calls) and self.calls[i].startswith(prefix):
+			if limit != None and len(found) >= limit:
+				break
+			found.append((self.calls[i], self.ids[self.calls[i]]))
+			i += 1
+		return found
+
+	# Return the (call, dmr_ids) matching pattern: a call sign, or a
+	# prefix followed by "*", as in "W1A*"
+	def search(self, pattern, limit=None):
+		if pattern.endswith("*"):
+			return self.prefix(pattern[:-1], limit)
+		ids = self.lookup(pattern)
+		if len(ids) == 0:
+			return []
+		return [(pattern.upper(), ids)]
 
 def cleanup_blanks(field):
 	# remove leading and trailing blanks
@@ -2297,7 +2757,7 @@ def removeRepeats(field):
 	if len(words) < 4 or len(words) % 2 != 0:
 		return field
 
-	hlen = len(words) / 2
+	hlen = len(words) // 2
 	for i in range(hlen):
 		if words[i] != words[i+hlen]:
 			return field
@@ -2347,8 +2807,11 @@ def fixRomanNumerals(field):
 
 # Return True for United States call signs.
 def US_Call(user):
-	first = user["call"][0]
-	second = user["call"][1]
+	first = user.call[:1]
+	second = user.call[1:2]
+	if first == "":
+		return False
+
 	if first in "KNW":
 		return True
 
@@ -2357,45 +2820,50 @@ def US_Call(user):
 
 	return False
 
+# If the country field holds a state name, move it to the state field
+# (unless that is already set) and replace it with the state's country.
+# Georgia is only taken to be a state for US call signs.
 def fixStateCountries(user):
-	for country, abbrevStates in stateAbbrevsByCountry.iteritems():
-		for state in abbrevStates:
-			if user["country"] == state:
-				if state == "Georgia" and not US_Call(user):
-					continue
-				if user["state"] == "":
-					user["state"] = state
-				user["country"] = country
-	return user
+	state = user.country
+	country = stateCountries.get(state)
+	if country is None:
+		return user
 
-def checkTitleCase():
-	upperCaseDict = {word : True for word in upperCaseWords}
-	newWordDict = {}
+	if state == "Georgia" and not US_Call(user):
+		return user
 
-	for _, user in users.iteritems():
-		types = [ "name", "city", "state", "nick", "country"]
-		for field in [user[t] for t in types]:
-			for word in field.split():
-				if len(word) < 2:
-					continue
+	if user.state == "":
+		user.state = state
+	user.country = country
+	return user
 
-				allUpper = True
-				for char in word:
-					if char < "A" or char > "Z":
-						allUpper = False
-						break
+# Add the all upper-case words of user that are in neither titleCaseWords
+# nor upperCaseWords to newWordDict
+def findNewUpperCaseWords(user, newWordDict):
+	for field in (user.name, user.city, user.state, user.nick,
+			user.country):
+		for word in field.split():
+			if len(word) < 2:
+				continue
 
-				if not allUpper:
-					continue
+			allUpper = True
+			for char in word:
+				if char < "A" or char > "Z":
+					allUpper = False
+					break
 
-				if word in titleCaseDict:
-					continue
+			if not allUpper:
+				continue
 
-				if word in upperCaseDict:
-					continue
+			if word in titleCaseDict:
+				continue
+
+			if word in upperCaseDict:
+				continue
 
-				newWordDict[word] = True
+			newWordDict[word] = True
 
+def printNewUpperCaseWords(newWordDict):
 	if len(newWordDict) == 0:
 		print("No new upper-case words.", file=sys.stderr)
 		return
@@ -2404,79 +2872,456 @@ def checkTitleCase():
 	for word in sorted(newWordDict):
 		print("\t" + word, file=sys.stderr)
 
-def massage_users():
-	for dmr_id, user in users.iteritems():
-		# remove blanks from within callsigns for ids >= 1000000
-		if int(dmr_id) >= 1000000:
-			user["call"] = user["call"].replace(" ", "")
-
-		if options["removeDupSurnames"]:
-			user["name"] = removeDupSurnames(user["name"])
-
-		if options["removeRepeats"]:
-			for key, val in user.iteritems():
-				user[key] = removeRepeats(val)
-
-		if options["titleCase"]:
-			user["name"] = titleCase(user["name"])
-			user["city"] = titleCase(user["city"])
-			user["state"] = titleCase(user["state"])
-			user["nick"] = titleCase(user["nick"])
-			user["country"] = titleCase(user["country"])
-
-		if options["removeMatchingNick"]:
-			first = user["name"].split(" ", 2)[0]
-			if first == user["nick"]:
-				user["nick"] = ""
-		else:
-			if user["nick"] == "":
-				user["nick"] = user["name"].split(" ", 2)[0]
-
-		if options["removeNames"]:
-			user["name"] = ""
-			user["nick"] = ""
-
-		if options["fixStateCountries"]:
-			user = fixStateCountries(user)
+# The number of records sent to a massage worker at a time
+massageBatchSize = 20000
+
+# The massage function of a massage worker process, compiled from the
+# options it is started with.  It is set only in the worker processes.
+workerMassage = None
+
+def init_massage_worker(options):
+	global workerMassage
+
+	workerMassage = compile_massage(options)
+
+# Massage a batch of records in a worker process.  The batch is a
+# marshalled list of (dmr_id, fields) pairs; the massaged fields are
+# returned marshalled in the same order.
+def massage_batch(data):
+	massaged = []
+	for dmr_id, fields in marshal.loads(data):
+		user = User(*fields)
+		workerMassage(dmr_id, user)
+		massaged.append(user.fields())
+	return marshal.dumps(massaged)
+
+# The steps of massage_user, in the order they are applied.  Each is
+# called with the options, the integer DMR ID and the User.
+
+# remove blanks from within callsigns for ids >= 1000000
+def massage_call_blanks(options, dmr_id, user):
+	if dmr_id >= 1000000:
+		user.call = user.call.replace(" ", "")
+
+def massage_remove_dup_surnames(options, dmr_id, user):
+	if options["removeDupSurnames"]:
+		user.name = removeDupSurnames(user.name)
+
+def massage_remove_repeats(options, dmr_id, user):
+	if options["removeRepeats"]:
+		for key in userFields:
+			setattr(user, key, removeRepeats(getattr(user, key)))
+
+def massage_title_case(options, dmr_id, user):
+	if options["titleCase"]:
+		user.name = titleCase(user.name)
+		user.city = titleCase(user.city)
+		user.state = titleCase(user.state)
+		user.nick = titleCase(user.nick)
+		user.country = titleCase(user.country)
+
+def massage_remove_matching_nick(options, dmr_id, user):
+	if options["removeMatchingNick"]:
+		first = user.name.split(" ", 2)[0]
+		if first == user.nick:
+			user.nick = ""
+	else:
+		if user.nick == "":
+			user.nick = user.name.split(" ", 2)[0]
+
+def massage_remove_names(options, dmr_id, user):
+	if options["removeNames"]:
+		user.name = ""
+		user.nick = ""
+
+def massage_fix_state_countries(options, dmr_id, user):
+	if options["fixStateCountries"]:
+		fixStateCountries(user)
+
+def massage_abbrev_countries(options, dmr_id, user):
+	if options["abbrevCountries"]:
+		abbrev = countryAbbrevs.get(user.country.upper(), "")
+		if abbrev != "":
+			user.country = abbrev
+	else:
+		country = countryAbbrevsInverse.get(user.country.upper(), "")
+		if country != "":
+			user.country = country
+
+def massage_abbrev_states(options, dmr_id, user):
+	if options["abbrevStates"]:
+		abbrev = stateAbbrevs.get(user.state.upper(), "")
+		if abbrev != "":
+			user.state = abbrev
+	else:
+		state = stateAbbrevsInverse.get(user.state.upper(), "")
+		if state != "":
+			user.state = state
+
+def massage_abbrev_directions(options, dmr_id, user):
+	if options["abbrevDirections"]:
+		user.city = abbrevDirections(user.city)
+		user.state = abbrevDirections(user.state)
+
+def massage_remove_call_from_nick(options, dmr_id, user):
+	if options["removeCallFromNick"]:
+		user.nick = removeSubstr(user.nick, user.call)
+
+def massage_misc_changes(options, dmr_id, user):
+	if options["miscChanges"]:
+		if user.city.endswith(" (B,"):
+			user.city = user.city[:-len(" (B")]
+
+def massage_fix_roman_numerals(options, dmr_id, user):
+	if options["fixRomanNumerals"]:
+		user.name = fixRomanNumerals(user.name)
+
+def massage_cleanup_blanks(options, dmr_id, user):
+	for key in userFields:
+		setattr(user, key, cleanup_blanks(getattr(user, key)))
+
+massageSteps = [
+	("callBlanks",		massage_call_blanks),
+	("removeDupSurnames",	massage_remove_dup_surnames),
+	("removeRepeats",	massage_remove_repeats),
+	("titleCase",		massage_title_case),
+	("removeMatchingNick",	massage_remove_matching_nick),
+	("removeNames",		massage_remove_names),
+	("fixStateCountries",	massage_fix_state_countries),
+	("abbrevCountries",	massage_abbrev_countries),
+	("abbrevStates",	massage_abbrev_states),
+	("abbrevDirections",	massage_abbrev_directions),
+	("removeCallFromNick",	massage_remove_call_from_nick),
+	("miscChanges",		massage_misc_changes),
+	("fixRomanNumerals",	massage_fix_roman_numerals),
+	("cleanupBlanks",	massage_cleanup_blanks),
+]
 
-		if options["abbrevCountries"]:
-			abbrev = countryAbbrevs.get(user["country"].upper(), "")
-			if abbrev != "":
-				user["country"] = abbrev
+# Memo caches the results of a function of a single string.  It is
+# bounded to about maxSize entries, evicting approximately the least
+# recently used: when the current generation fills up it becomes the old
+# generation, and entries found there are promoted back into the current
+# one.
+class Memo(object):
+	def __init__(self, func, maxSize):
+		self.func = func
+		self.maxSize = maxSize
+		self.current = {}
+		self.old = {}
+		self.hits = 0
+		self.misses = 0
+
+	def __call__(self, value):
+		result = self.current.get(value)
+		if result is not None:
+			self.hits += 1
+			return result
+
+		result = self.old.get(value)
+		if result is not None:
+			self.hits += 1
 		else:
-			country = countryAbbrevsInverse.get(user["country"].upper(), "")
-			if country != "":
-				user["country"] = country
-
-		if options["abbrevStates"]:
-			abbrev = stateAbbrevs.get(user["state"].upper(), "")
+			self.misses += 1
+			result = self.func(value)
+
+		if len(self.current) >= self.maxSize:
+			self.old = self.current
+			self.current = {}
+		self.current[value] = result
+		return result
+
+memoSize = 1 << 16
+
+# Memos by (field kind, options fingerprint)
+fieldMemos = {}
+
+# Return a memoized function applying the functions of chain in order
+# and interning the result
+def field_memo(kind, fingerprint, chain):
+	chain = [func for func in chain if func != None]
+
+	def apply_chain(value):
+		for func in chain:
+			value = func(value)
+		return intern(value)
+
+	if len(chain) == 0:
+		return apply_chain
+
+	key = (kind, fingerprint)
+	memo = fieldMemos.get(key)
+	if memo == None:
+		memo = Memo(apply_chain, memoSize)
+		fieldMemos[key] = memo
+	return memo
+
+def print_memo_stats():
+	for (kind, _), memo in sorted(fieldMemos.items()):
+		print("memo {0}: {1} hits, {2} misses, {3} cached".format(kind,
+			memo.hits, memo.misses,
+			len(memo.current) + len(memo.old)), file=sys.stderr)
+
+# Compile the enabled massage steps into a function with exactly the
+# same effect as applying massageSteps in order.  The options are tested
+# once, here, rather than for every record.  The word-based steps
+# (removeDupSurnames, removeRepeats and titleCase) share a single split
+# of each field, and join it again only if one of them changed it.
+def compile_massage(options):
+	dupSurnames = options["removeDupSurnames"]
+	repeats = options["removeRepeats"]
+	title = options["titleCase"]
+
+	def words_transform(dup):
+		if not (dup or repeats or title):
+			return None
+
+		def transform(field):
+			words = field.split()
+			changed = title
+			if dup and len(words) > 2 and words[-2] == words[-1]:
+				del words[-1]
+				changed = True
+			if repeats:
+				n = len(words)
+				if n >= 4 and n % 2 == 0:
+					half = n // 2
+					if words[:half] == words[half:]:
+						del words[half:]
+						changed = True
+			if not changed:
+				return field
+			if title:
+				words = [titleCaseDict.get(word, word) for word in words]
+			return " ".join(words)
+
+		return transform
+
+	nameWords = words_transform(dupSurnames)
+	fieldWords = words_transform(False)
+
+	# The city, state and country fields are each transformed by a chain
+	# of functions of that field alone (apart from fixStateCountries),
+	# so those chains are memoized.
+	cityChain = [fieldWords]
+	statePreChain = [fieldWords]
+	countryPreChain = [fieldWords]
+	stateChain = []
+	countryChain = []
+
+	if options["abbrevCountries"]:
+		def abbrevCountry(country):
+			abbrev = countryAbbrevs.get(country.upper(), "")
 			if abbrev != "":
-				user["state"] = abbrev
+				return abbrev
+			return country
+		countryChain.append(abbrevCountry)
+	else:
+		def expandCountry(country):
+			expanded = countryAbbrevsInverse.get(country.upper(), "")
+			if expanded != "":
+				return expanded
+			return country
+		countryChain.append(expandCountry)
+
+	if options["abbrevStates"]:
+		def abbrevState(state):
+			abbrev = stateAbbrevs.get(state.upper(), "")
+			if abbrev != "":
+				return abbrev
+			return state
+		stateChain.append(abbrevState)
+	else:
+		def expandState(state):
+			expanded = stateAbbrevsInverse.get(state.upper(), "")
+			if expanded != "":
+				return expanded
+			return state
+		stateChain.append(expandState)
+
+	if options["abbrevDirections"]:
+		cityChain.append(abbrevDirections)
+		stateChain.append(abbrevDirections)
+
+	if options["miscChanges"]:
+		def miscChanges(city):
+			if city.endswith(" (B,"):
+				city = city[:-len(" (B")]
+			return city
+		cityChain.append(miscChanges)
+
+	cityChain.append(cleanup_blanks)
+	stateChain.append(cleanup_blanks)
+	countryChain.append(cleanup_blanks)
+
+	fixStates = options["fixStateCountries"]
+	if not fixStates:
+		stateChain = statePreChain + stateChain
+		countryChain = countryPreChain + countryChain
+		statePreChain = []
+		countryPreChain = []
+
+	fingerprint = repr(sorted(options.items()))
+	cityMemo = field_memo("city", fingerprint, cityChain)
+	statePreMemo = field_memo("statePre", fingerprint, statePreChain)
+	countryPreMemo = field_memo("countryPre", fingerprint, countryPreChain)
+	stateMemo = field_memo("state", fingerprint, stateChain)
+	countryMemo = field_memo("country", fingerprint, countryChain)
+
+	steps = []
+
+	if options["removeMatchingNick"]:
+		def removeMatchingNick(user):
+			if user.name.split(" ", 2)[0] == user.nick:
+				user.nick = ""
+		steps.append(removeMatchingNick)
+	else:
+		def addNick(user):
+			if user.nick == "":
+				user.nick = user.name.split(" ", 2)[0]
+		steps.append(addNick)
+
+	if options["removeNames"]:
+		def removeNames(user):
+			user.name = ""
+			user.nick = ""
+		steps.append(removeNames)
+
+	if options["removeCallFromNick"]:
+		def removeCallFromNick(user):
+			user.nick = removeSubstr(user.nick, user.call)
+		steps.append(removeCallFromNick)
+
+	if options["fixRomanNumerals"]:
+		def fixNameRomanNumerals(user):
+			user.name = fixRomanNumerals(user.name)
+		steps.append(fixNameRomanNumerals)
+
+	def massage(dmr_id, user):
+		# removeRepeats leaves the id, a single word, unchanged.  The
+		# call still goes through it after its blanks are removed,
+		# since it may hold other whitespace, such as tabs.
+		if dmr_id >= 1000000:
+			user.call = user.call.replace(" ", "")
+		if repeats:
+			user.call = removeRepeats(user.call)
+
+		if nameWords != None:
+			user.name = nameWords(user.name)
+		if fieldWords != None:
+			user.nick = fieldWords(user.nick)
+
+		user.city = cityMemo(user.city)
+		if fixStates:
+			user.state = statePreMemo(user.state)
+			user.country = countryPreMemo(user.country)
+			fixStateCountries(user)
+		user.state = stateMemo(user.state)
+		user.country = countryMemo(user.country)
+
+		for step in steps:
+			step(user)
+
+		user.id = cleanup_blanks(user.id)
+		user.call = cleanup_blanks(user.call)
+		user.name = cleanup_blanks(user.name)
+		user.nick = cleanup_blanks(user.nick)
+
+	return massage
+
+# A sorted list of disjoint DMR ID ranges.  Overlapping and adjacent
+# ranges are coalesced, so membership is a single bisect.
+class IDRanges(object):
+	def __init__(self, idRanges):
+		self.starts = []
+		self.ends = []
+		for lo, hi in sorted(idRanges):
+			if self.ends and lo <= self.ends[-1] + 1:
+				self.ends[-1] = max(self.ends[-1], hi)
+				continue
+			self.starts.append(lo)
+			self.ends.append(hi)
+
+	def __contains__(self, dmr_id):
+		i = bisect.bisect_right(self.starts, dmr_id) - 1
+		return i >= 0 and dmr_id <= self.ends[i]
+
+	def __len__(self):
+		return len(self.starts)
+
+# The include/exclude ID and country rules that apply to one input file,
+# combining the rules for the file with those given for "*".  The rules
+# are those of a Merger, which map a filename (or "*") to a list of ID
+# ranges or upper-case country names.
+class UserFilter(object):
+	def __init__(self, filename, excludedIDRanges, includedIDRanges,
+			excludedCountries, includedCountries):
+		names = [filename, "*"]
+
+		self.excludedCountries = frozenset(country
+			for name in names
+			for country in excludedCountries.get(name, []))
+
+		self.includedCountries = None
+		if filename in includedCountries or "*" in includedCountries:
+			self.includedCountries = frozenset(country
+				for name in names
+				for country in includedCountries.get(name, []))
+
+		self.excludedIDs = None
+		if filename in excludedIDRanges or "*" in excludedIDRanges:
+			self.excludedIDs = IDRanges([idRange
+				for name in names
+				for idRange in excludedIDRanges.get(name, [])])
+
+		self.includedIDs = None
+		if filename in includedIDRanges or "*" in includedIDRanges:
+			self.includedIDs = IDRanges([idRange
+				for name in names
+				for idRange in includedIDRanges.get(name, [])])
+
+	# Return a value that changes whenever the filter's rules change
+	def fingerprint(self):
+		rules = [sorted(self.excludedCountries)]
+		if self.includedCountries is not None:
+			rules.append(sorted(self.includedCountries))
 		else:
-			state = stateAbbrevsInverse.get(user["state"].upper(), "")
-			if state != "":
-				user["state"] = state
-
-		if options["abbrevDirections"]:
-			user["city"] = abbrevDirections(user["city"])
-			user["state"] = abbrevDirections(user["state"])
-
-		if options["removeCallFromNick"]:
-			user["nick"] = removeSubstr(user["nick"], user["call"])
-
-		if options["miscChanges"]:
-			if user["city"].endswith(" (B,"):
-				user["city"] = user["city"][:-len(" (B")]
-
-		if options["fixRomanNumerals"]:
-			user["name"] = fixRomanNumerals(user["name"])
+			rules.append(None)
+		for idRanges in (self.excludedIDs, self.includedIDs):
+			if idRanges is not None:
+				rules.append((idRanges.starts, idRanges.ends))
+			else:
+				rules.append(None)
+		return rules
+
+	# Return True if a record with the given ID and country passes
+	def accepts(self, dmr_id, country):
+		if self.excludedCountries or self.includedCountries is not None:
+			country = country.upper()
+			if country in self.excludedCountries:
+				return False
+			if self.includedCountries is not None:
+				if country not in self.includedCountries:
+					return False
+
+		if self.excludedIDs is not None:
+			if dmr_id in self.excludedIDs:
+				return False
+
+		if self.includedIDs is not None:
+			if dmr_id not in self.includedIDs:
+				return False
 
-		for key, val in user.iteritems():
-			user[key] = cleanup_blanks(val)
+		return True
 
-		users[dmr_id] = user
+# Report a problem with an input line
+def print_warning(message):
+	print(message, file=sys.stderr)
 
-def read_user_line(file, i, line):
+# Validate and filter a line of a userdb file.
+# Returns (dmr_id, fields) where dmr_id is the integer DMR ID and fields
+# holds the 7 string values, or None if the line is to be ignored.
+# Problems with the line are passed to warn.
+def parse_user_line(file, i, line, userFilter, warn=print_warning):
 	if i == 1 and "," not in line:
 		try:
 			int(line)
@@ -2487,21 +3332,20 @@ def read_user_line(file, i, line):
 	line = line.strip("\n")
 
 	if line == "":
-		print("{0}:{1} Empty line.".format(file.name, i),
-			file=sys.stderr)
+		warn("{0}:{1} Empty line.".format(file.name, i))
 		return
 
 	fields = line.split(",")
 
 	try:
 		i_dmr_id = int(fields[0])
-		if i_dmr_id > 16777215:
-			print("{0}:{1} Invalid DMR ID value: {2}".format(
-				file.name, i, line), file=sys.stderr)
+		if i_dmr_id < 0 or i_dmr_id > maxDMRID:
+			warn("{0}:{1} Invalid DMR ID value: {2}".format(
+				file.name, i, line))
 			return
 	except ValueError:
-		print("{0}:{1} Non-numeric first value (DMR ID): {2}".format(
-			file.name, i, line), file=sys.stderr)
+		warn("{0}:{1} Non-numeric first value (DMR ID): {2}".format(
+			file.name, i, line))
 		return
 
 	if len(fields) != 7:
@@ -2514,273 +3358,1637 @@ def read_user_line(file, i, line):
 				file.name, i, len(fields), line)
 
 		fields = fields[:7]
-		print(err, file=sys.stderr)
+		warn(err)
 
-	dmr_id, call, name, city, state, nick, country = fields
+	if not userFilter.accepts(i_dmr_id, fields[6]):
+		return
 
-	if file.name in excludedCountries:
-		if country.upper() in excludedCountries[file.name]:
-			return
+	return i_dmr_id, fields
 
-	if "*" in excludedCountries:
-		if country.upper() in excludedCountries["*"]:
-			return
+# Convert "id" or "id1-id2" into [id1, id2], or None if it is malformed
+# or reversed
+def parseIDRange(idRange):
+	ids = idRange.split("-", 2)
+	if len(ids) == 1:
+		ids = [ids[0], ids[0]]
 
-	includedCountry = True
-	if file.name in includedCountries or "*" in includedCountries:
-		includedCountry = False
-		if file.name in includedCountries:
-			if country.upper() in includedCountries[file.name]:
-				includedCountry = True
-		if "*" in includedCountries:
-			if country.upper() in includedCountries["*"]:
-				includedCountry = True
-	if not includedCountry:
-		return
+	try:
+		ids = [int(ids[0]), int(ids[1])]
+	except ValueError:
+		return None
+
+	if ids[0] > ids[1]:
+		return None
+	return ids
+
+# Files smaller than twice this size are parsed by a single worker
+minChunkSize = 4 * 1024 * 1024
+
+# Return the number of newlines in the next n bytes of file
+def count_newlines(file, n):
+	count = 0
+	while n > 0:
+		block = file.read(min(n, 1024 * 1024))
+		if not block:
+			break
+		count += block.count(b"\n")
+		n -= len(block)
+	return count
+
+# Split a file into up to nChunks (filename, start, end, firstLine) tasks.
+# Chunks begin at the start of a line, and firstLine is the line number
+# of that line.  An end of None is the end of the file.  A compressed
+# file can't be split, so it is a single chunk.
+def file_chunks(filename, nChunks):
+	if input_compression(filename) != None:
+		return [(filename, 0, None, 1)]
+
+	size = os.path.getsize(filename)
+	nChunks = max(1, min(nChunks, size // minChunkSize))
+	chunks = []
+	start = 0
+	firstLine = 1
+	file = open(filename, "rb")
+	for k in range(1, nChunks):
+		file.seek(max(start, size * k // nChunks))
+		file.readline()
+		end = file.tell()
+		if end >= size:
+			break
+		chunks.append((filename, start, end, firstLine))
+		file.seek(start)
+		firstLine += count_newlines(file, end - start)
+		start = end
+	file.close()
+	chunks.append((filename, start, size, firstLine))
+	return chunks
+
+# Parse one chunk of a file, given as a file_chunks task followed by the
+# UserFilter of the file, in a worker process.  Returns the chunk's
+# partial map of integer DMR ID to merged fields tuple, along with the
+# messages about its lines, so the parent can print them in order.  The
+# messages are collected rather than printed, since other threads of the
+# process may be writing to stderr.
+def parse_chunk(chunk):
+	filename, start, end, i, userFilter = chunk
+
+	warnings = []
+	partial = {}
+	# Lines are read as bytes, or as one character per byte, so the
+	# offset of each line is tracked by adding up their lengths rather
+	# than by asking the file for it.
+	offset = start
+	file = open_file(filename)
+	try:
+		if start > 0:
+			file.seek(start)
+		for line in file:
+			if end != None and offset >= end:
+				break
+			offset += len(line)
+			parsed = parse_user_line(file, i, line, userFilter,
+				warnings.append)
+			i += 1
+			if parsed is None:
+				continue
 
-	excludedID = False
-	if file.name in excludedIDRanges:
-		for idRange in excludedIDRanges[file.name]:
-			if i_dmr_id >= idRange[0] and i_dmr_id <= idRange[1]:
-				excludedID = True
-	if "*" in excludedIDRanges:
-		for idRange in excludedIDRanges["*"]:
-			if i_dmr_id >= idRange[0] and i_dmr_id <= idRange[1]:
-				excludedID = True
-	if excludedID:
-		return
+			dmr_id, fields = parsed
+			old = partial.get(dmr_id)
+			if old is None:
+				if any(fields[1:]):
+					partial[dmr_id] = tuple(fields)
+				continue
 
-	includedID = True
-	if file.name in includedIDRanges or "*" in includedIDRanges:
-		includedID = False
-		if file.name in includedIDRanges:
-			for idRange in includedIDRanges[file.name]:
-				if i_dmr_id >= idRange[0] and i_dmr_id <= idRange[1]:
-					includedID = True
-		if "*" in includedIDRanges:
-			for idRange in includedIDRanges[file.name]:
-				if i_dmr_id >= idRange[0] and i_dmr_id <= idRange[1]:
-					includedID = True
-	if not includedID:
-		return
+			partial[dmr_id] = merge_fields(old, fields)
+	finally:
+		file.close()
 
-	new_user = {
-		"call": call,
-		"name": name,
-		"city": city,
-		"state": state,
-		"nick": nick,
-		"country": country,
-	}
+	messages = "".join(warning + "\n" for warning in warnings)
+	return partial, messages
 
-	blank_user = {
-		"id": dmr_id,
-		"call": "",
-		"name": "",
-		"city": "",
-		"state": "",
-		"nick": "",
-		"country": "",
-	}
+# Merge the fields of a later record into those of an earlier one
+def merge_fields(old, new):
+	return (old[0],) + tuple([field or prev
+		for prev, field in zip(old[1:], new[1:])])
 
-	user = users.get(dmr_id, blank_user)
+# Merge the later partial map other into partial
+def merge_partials(partial, other):
+	if len(partial) == 0:
+		return other
 
-	changed = False
-	for key, val in new_user.iteritems():
-		if val != "":
-			user[key] = val
-			changed = True
+	for dmr_id, fields in iteritems(other):
+		old = partial.get(dmr_id)
+		if old is None:
+			partial[dmr_id] = fields
+		else:
+			partial[dmr_id] = merge_fields(old, fields)
+	return partial
 
-	if changed:
-		users[dmr_id] = user
+# Output is written in blocks of this many lines
+outputBlockLines = 4096
+outputBufferSize = 1024 * 1024
 
-def excludeIDRanges(filename, idRanges, errPrefix):
-	if filename != "*":
-		try:
-			file = open(filename, "r")
-			file.close()
-		except IOError as err:
-			errors.append(errPrefix + str(err))
+def abort_output(out, tmpPath):
+	if tmpPath == None:
+		return
+
+	out.close()
+	try:
+		os.remove(tmpPath)
+	except OSError:
+		pass
+
+# Sync the complete temporary file tmpPath and rename it to filename
+def install_file(tmpPath, filename):
+	fd = os.open(tmpPath, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+	# mkstemp creates the file readable only by its owner.  Give it the
+	# mode of the file it replaces, or else that of a newly created file.
+	try:
+		mode = stat.S_IMODE(os.stat(filename).st_mode)
+	except OSError:
+		umask = os.umask(0)
+		os.umask(umask)
+		mode = 0o666 & ~umask
+	os.chmod(tmpPath, mode)
+
+	if hasattr(os, "replace"):
+		os.replace(tmpPath, filename)
+	else:
+		os.rename(tmpPath, filename)
+
+# The lookup index of an output file is written next to it, with this
+# suffix.  It holds a header identifying the output file, followed by a
+# binary userdb of the output's records indexed by call sign.  Bump
+# indexFormat whenever the header changes.
+indexSuffix = ".idx"
+indexMagic = b"MDUX"
+indexFormat = 1
+indexHeaderFormat = "<4sIQQd"
+indexHeaderSize = struct.calcsize(indexHeaderFormat)
+
+# Return the size, inode and modification time of filename, which
+# change whenever the file is written or replaced
+def file_identity(filename):
+	st = os.stat(filename)
+	return st.st_size, st.st_ino, st.st_mtime
+
+# Yield the (dmr_id, text) of the records of an output file, CSV or
+# binary and compressed or not, where text is the bytes of the fields.
+# Raises MergeError if the file is malformed.
+def output_records(filename):
+	file = open_file(filename, "rb")
+	try:
+		line = file.readline()
+		if line.startswith(binary_users.magic):
+			try:
+				users = binary_users.BinaryUsers(line + file.read())
+			except ValueError as err:
+				raise MergeError("{0}: {1}".format(filename, err))
+			for record in users.records():
+				yield record
 			return
 
-	for idRange in idRanges:
-		ids = idRange.split("-", 2)
-		if len(ids) == 1:
-			ids = [ids[0], ids[0]]
+		# Skip the header, a line holding only the byte count
+		i = 1
+		if line != b"" and b"," not in line:
+			line = file.readline()
+			i += 1
 
+		while line != b"":
+			dmr_id, _, text = line.rstrip(b"\n").partition(b",")
+			try:
+				dmr_id = int(dmr_id)
+			except ValueError:
+				raise MergeError("{0}:{1}: bad record: {2}".format(
+					filename, i, from_bytes(line.rstrip(b"\n"))))
+			yield dmr_id, text
+			line = file.readline()
+			i += 1
+	finally:
+		file.close()
+
+# The lookup index of the output file outputFile.  Raises MergeError if
+# there is no index, or if the output file has changed since the index
+# was written.
+class OutputIndex(object):
+	def __init__(self, outputFile):
+		indexFile = outputFile + indexSuffix
 		try:
-			ids = [int(ids[0]), int(ids[1])]
-		except ValueError:
-			errors.append(errPrefix + "bad IDRange {0}".format(idRange))
+			identity = file_identity(outputFile)
+			file = open(indexFile, "rb")
+			header = file.read(indexHeaderSize)
+			file.close()
+		except (IOError, OSError) as err:
+			raise MergeError("{0}: no lookup index: {1}".format(
+				outputFile, err))
+
+		if len(header) < indexHeaderSize or \
+				header[:4] != indexMagic or \
+				struct.unpack_from("<I", header, 4)[0] != indexFormat:
+			raise MergeError("{0}: not a lookup index".format(indexFile))
+		if struct.unpack(indexHeaderFormat, header)[2:] != identity:
+			raise MergeError("{0}: out of date, {1} has changed".format(
+				indexFile, outputFile))
+
+		try:
+			self.users = binary_users.map_binary(indexFile,
+				indexHeaderSize)
+		except (IOError, ValueError) as err:
+			raise MergeError("{0}: {1}".format(indexFile, err))
+		self.outputFile = outputFile
+
+	def __len__(self):
+		return len(self.users)
+
+	def user(self, i):
+		fields = [from_bytes(field)
+			for field in self.users.text(i).split(b",")]
+		return User(str(self.users.id(i)), *fields)
+
+	# Return the (dmr_id, user) pairs of key, as Merger.lookup
+	def lookup(self, key, limit=None):
+		if key.isdigit():
+			i = self.users.find(int(key))
+			if i is None:
+				return []
+			return [(int(key), self.user(i))]
+
+		found = []
+		prefix = key.endswith("*")
+		if prefix:
+			key = key[:-1]
+		lastCall = None
+		calls = 0
+		for i in self.users.find_call(to_bytes(key), prefix):
+			call = self.users.call(i).upper()
+			if call != lastCall:
+				if limit != None and calls >= limit:
+					break
+				lastCall = call
+				calls += 1
+			found.append((self.users.id(i), self.user(i)))
+		return found
+
+	def close(self):
+		self.users.close()
+
+# Write lines to out, a block of lines at a time.
+# Returns the number of lines.
+def write_lines(out, lines):
+	count = 0
+	block = []
+	for line in lines:
+		block.append(line)
+		if len(block) >= outputBlockLines:
+			block.append("")
+			out.write("\n".join(block))
+			count += len(block) - 1
+			block = []
+
+	if len(block) > 0:
+		block.append("")
+		out.write("\n".join(block))
+		count += len(block) - 1
+
+	return count
+
+# Bump stateFormat whenever the format of incremental state files changes
+stateFormat = 2
+
+# Merge the fields of a line into the partial map, as parse_chunk does
+def add_line_fields(partial, dmr_id, fields):
+	old = partial.get(dmr_id)
+	if old is None:
+		if any(fields[1:]):
+			partial[dmr_id] = tuple(fields)
+		return
+
+	partial[dmr_id] = merge_fields(old, fields)
+
+# Return a 64-bit checksum of a line, which stands for the line in the
+# line indexes of --incremental
+def line_key(line):
+	data = to_bytes(line)
+	return (zlib.crc32(data) & 0xffffffff) << 32 | \
+		(zlib.adler32(data) & 0xffffffff)
+
+# Index the lines of a file for --incremental.  The line index kept in
+# the incremental state holds:
+#
+#	ids, positions, keys: the DMR ID, position and line_key of each line
+#		accepted by the filter, sorted by DMR ID and then by line.  The
+#		position of a line is its byte offset, or its line number in a
+#		compressed file, which can't be seeked.
+#	skipped: the keys of the lines that were rejected without a message
+#	noisy: the keys of the lines that gave messages
+#
+# Given the line index of an earlier version of the file, the lines it
+# holds are not parsed again, unless they gave messages, whose line
+# numbers may have changed.  Otherwise each line is parsed, and the
+# partial map of the file is returned too, as by parse_chunk.  Returns
+# (partial, messages, lineIndex).
+def index_file(filename, userFilter, old=None):
+	known = {}
+	skipped = set()
+	noisy = set()
+	partial = {}
+	if old != None:
+		known = dict(zip(old[2], old[0]))
+		skipped = set(old[3])
+		noisy = set(old[4])
+		partial = None
+
+	compressed = input_compression(filename) != None
+	warnings = []
+	ids = []
+	positions = []
+	keys = []
+	newSkipped = set()
+	newNoisy = set()
+	offset = 0
+	file = open_file(filename)
+	try:
+		i = 1
+		for line in file:
+			position = offset
+			if compressed:
+				position = i
+			offset += len(line)
+			key = line_key(line)
+			i += 1
+
+			if key not in noisy:
+				dmr_id = known.get(key)
+				if dmr_id != None:
+					ids.append(dmr_id)
+					positions.append(position)
+					keys.append(key)
+					continue
+				if key in skipped:
+					newSkipped.add(key)
+					continue
+
+			nWarnings = len(warnings)
+			parsed = parse_user_line(file, i - 1, line, userFilter,
+				warnings.append)
+			if len(warnings) > nWarnings:
+				newNoisy.add(key)
+			if parsed is None:
+				if len(warnings) == nWarnings:
+					newSkipped.add(key)
+				continue
+
+			dmr_id, fields = parsed
+			ids.append(dmr_id)
+			positions.append(position)
+			keys.append(key)
+			if partial != None:
+				add_line_fields(partial, dmr_id, fields)
+	finally:
+		file.close()
+
+	order = sorted(range(len(ids)), key=ids.__getitem__)
+	lineIndex = ([ids[k] for k in order], [positions[k] for k in order],
+		[keys[k] for k in order], list(newSkipped), list(newNoisy))
+	messages = "".join(warning + "\n" for warning in warnings)
+	return partial, messages, lineIndex
+
+# Return the DMR IDs whose lines differ between two line indexes
+def changed_ids(old, new):
+	changed = set()
+	oldKeys = set(old[2])
+	newKeys = set(new[2])
+	for lineIndex, keys in ((old, oldKeys - newKeys),
+			(new, newKeys - oldKeys)):
+		if len(keys) > 0:
+			changed.update(dmr_id
+				for dmr_id, key in zip(lineIndex[0], lineIndex[2])
+				if key in keys)
+
+	# The lines of an ID that were only reordered change which of them
+	# take precedence
+	def repeated(lineIndex):
+		ids, _, keys = lineIndex[:3]
+		lines = {}
+		for k in range(1, len(ids)):
+			if ids[k] == ids[k - 1]:
+				if ids[k] not in lines:
+					lines[ids[k]] = [keys[k - 1]]
+				lines[ids[k]].append(keys[k])
+		return lines
+
+	oldRepeated = repeated(old)
+	newRepeated = repeated(new)
+	for dmr_id, keys in iteritems(newRepeated):
+		if oldRepeated.get(dmr_id) != keys:
+			changed.add(dmr_id)
+	for dmr_id in oldRepeated:
+		if dmr_id not in newRepeated:
+			changed.add(dmr_id)
+	return changed
+
+# Return the partial map of the DMR IDs dmrIDs in a file, reading only
+# their lines, as found by the file's line index.  The lines are read
+# in a single pass if the file is compressed or most of it is wanted.
+def read_indexed_partial(filename, userFilter, lineIndex, dmrIDs):
+	ids, positions = lineIndex[:2]
+	wanted = {}
+	for dmr_id in dmrIDs:
+		for k in range(bisect.bisect_left(ids, dmr_id),
+				bisect.bisect_right(ids, dmr_id)):
+			wanted[positions[k]] = dmr_id
+
+	lines = []
+	file = open_file(filename)
+	try:
+		if input_compression(filename) != None or \
+				len(wanted) > len(ids) // 16:
+			compressed = input_compression(filename) != None
+			offset = 0
+			i = 1
+			for line in file:
+				position = offset
+				if compressed:
+					position = i
+				offset += len(line)
+				i += 1
+				if position in wanted:
+					lines.append(line)
+		else:
+			for position in sorted(wanted):
+				file.seek(position)
+				lines.append(file.readline())
+
+		partial = {}
+		for line in lines:
+			parsed = parse_user_line(file, 0, line, userFilter,
+				lambda warning: None)
+			if parsed is not None:
+				add_line_fields(partial, parsed[0], parsed[1])
+	finally:
+		file.close()
+
+	return partial
+
+def cpu_time():
+	times = os.times()
+	return times[0] + times[1] + times[2] + times[3]
+
+def stage_begin():
+	if tracemalloc != None and tracemalloc.is_tracing():
+		if hasattr(tracemalloc, "reset_peak"):
+			tracemalloc.reset_peak()
+	return time.time(), cpu_time()
+
+# Raised for an error that ends a merge, such as an unsorted input file
+# with sortedInputs.  main prints it and exits.
+class MergeError(Exception):
+	pass
+
+# A Merger merges, massages and writes one set of userdb files.  All of
+# the state of a merge is kept in it: the options, the input and verbatim
+# files, the include/exclude rules and the merged records.  The tables
+# and the field memos are shared by all Mergers, so a program merging
+# more than once reuses them.  main drives a Merger built by process_args;
+# a program can also drive one directly:
+#
+#	merger = Merger(options={"abbrevStates": False},
+#		outputFile="users.csv")
+#	merger.excludeCountries("*", ["Japan"], "")
+#	merger.add_file("radioid.csv")
+#	merger.add_verbatim("overrides.csv")
+#	merger.merge()
+#	merger.output_users()
+#
+# The include/exclude and config methods append their errors to errors.
+# The other methods raise MergeError, or IOError for the files.
+class Merger(object):
+	def __init__(self, options=None, jobs=1, outputFile=None,
+			binaryOutput=False, binaryPool=False, binaryCalls=False,
+			writeIndex=False, sortedInputs=False, stateFile=None,
+			profileFormat=None, profileMemory=False, verbose=False,
+			debug=False):
+		self.options = {}
+		for opt in optionList:
+			self.options[opt["name"]] = opt["default"]
+		if options != None:
+			self.options.update(options)
+
+		self.files = []
+		self.verbatim = []
+		self.excludedIDRanges = {}
+		self.includedIDRanges = {}
+		self.excludedCountries = {}
+		self.includedCountries = {}
+		self.errors = []
+
+		# UserFilters by filename, compiled once per file by file_filter
+		self.fileFilters = {}
+
+		# users maps the integer DMR ID to its User record
+		self.users = {}
+
+		self.jobs = jobs
+		self.outputFile = outputFile
+		self.binaryOutput = binaryOutput or binaryPool or binaryCalls
+		self.binaryPool = binaryPool
+		self.binaryCalls = binaryCalls
+		self.writeIndex = writeIndex
+		self.sortedInputs = sortedInputs
+		self.stateFile = stateFile
+		self.verbose = verbose or debug
+		self.debug = debug
+		self.compiledMassage = None
+		self.callIndex = None
+
+		# Called with each message about a line of an input file
+		self.warn = print_warning
+
+		self.profileFormat = profileFormat
+		self.profileStages = []
+		self.fileProfiles = []
+		self.transformCounts = {}
+		if profileMemory and tracemalloc != None:
+			if not tracemalloc.is_tracing():
+				tracemalloc.start()
+
+	# Add an input file, given as a file or a filename.  Files are merged
+	# in the order they are added.
+	def add_file(self, file):
+		if not hasattr(file, "read"):
+			file = open_file(file)
+		self.files.append(file)
+
+	# Add a verbatim file, given as a file or a filename
+	def add_verbatim(self, file):
+		if not hasattr(file, "read"):
+			file = open_file(file)
+		self.verbatim.append(file)
+
+	# Close the input and verbatim files, other than stdin
+	def close_files(self):
+		for file in self.files + self.verbatim:
+			if file.name != "<stdin>":
+				file.close()
+
+	# Return (dmr_id, user) pairs of the merged records in DMR ID order
+	def sorted_users(self):
+		return sorted_users(self.users)
+
+	# Return the CallIndex of the merged users.  It is built by the first
+	# call after a merge.
+	def call_index(self):
+		if self.callIndex is None:
+			self.callIndex = CallIndex(self.sorted_users())
+		return self.callIndex
+
+	# Return the (dmr_id, user) pairs of key: a DMR ID, a call sign, or a
+	# call sign prefix followed by "*".  The users of a call sign are in
+	# DMR ID order, and the call signs of a prefix in call sign order.
+	def lookup(self, key, limit=None):
+		if key.isdigit():
+			user = self.users.get(int(key))
+			if user is None:
+				return []
+			return [(int(key), user)]
+
+		return [(dmr_id, self.users[dmr_id])
+			for _, ids in self.call_index().search(key, limit)
+			for dmr_id in ids]
+
+	# Merge the files into users: read and massage the input files, then
+	# apply the verbatim files.  With stateFile, the merge is incremental.
+	def merge(self):
+		if len(self.errors) > 0:
+			raise MergeError("\n".join(self.errors))
+		self.callIndex = None
+
+		if self.stateFile != None:
+			recordsIn = self.count_lines(self.files + self.verbatim)
+			begin = stage_begin()
+			self.incremental_merge()
+			self.stage_end("incremental_merge", begin, recordsIn,
+				len(self.users))
 			return
 
-		x = excludedIDRanges.get(filename, None)
-		if x == None:
-			excludedIDRanges[filename] = []
+		recordsIn = self.count_lines(self.files)
+		begin = stage_begin()
+		self.read_user_files(self.files)
+		self.stage_end("read_user_files", begin, recordsIn,
+			len(self.users))
+
+		if self.profileFormat != None:
+			begin = stage_begin()
+			self.count_transforms()
+			self.stage_end("count_transforms", begin, len(self.users),
+				len(self.users))
+
+		begin = stage_begin()
+		recordsIn = len(self.users)
+		self.massage_users()
+		self.stage_end("massage_users", begin, recordsIn, len(self.users))
+
+		recordsIn = self.count_lines(self.verbatim)
+		begin = stage_begin()
+		self.read_user_files(self.verbatim)
+		self.stage_end("read_verbatim", begin, recordsIn, len(self.users))
+
+	# Merge the files and write the output, as the command does
+	def run(self):
+		if self.sortedInputs:
+			recordsIn = self.count_lines(self.files + self.verbatim)
+			begin = stage_begin()
+			recordsOut = self.stream_users()
+			self.stage_end("stream_users", begin, recordsIn, recordsOut)
+			if self.profileFormat != None:
+				self.print_profile()
+			return
 
-		excludedIDRanges[filename].append(ids)
+		self.merge()
+
+		if self.verbose:
+			begin = stage_begin()
+			self.checkTitleCase()
+			self.stage_end("checkTitleCase", begin, len(self.users),
+				len(self.users))
+
+		begin = stage_begin()
+		self.output_users()
+		self.stage_end("output_users", begin, len(self.users),
+			len(self.users))
+
+		if self.profileFormat != None:
+			self.print_profile()
+
+	def file_filter(self, filename):
+		userFilter = self.fileFilters.get(filename)
+		if userFilter is None:
+			userFilter = UserFilter(filename, self.excludedIDRanges,
+				self.includedIDRanges, self.excludedCountries,
+				self.includedCountries)
+			self.fileFilters[filename] = userFilter
+		return userFilter
+
+	# Read the ID ranges listed in rangeFiles.  Each line holds any number
+	# of id[-id] ranges separated by blanks or commas.  Text following a #
+	# is ignored.
+	def readIDRangeFiles(self, rangeFiles, errPrefix):
+		idRanges = []
+		for rangeFile in rangeFiles:
+			try:
+				file = open_file(rangeFile)
+			except IOError as err:
+				self.errors.append(errPrefix + str(err))
+				continue
 
-def includeIDRanges(filename, idRanges, errPrefix):
-	if filename != "*":
-		try:
-			file = open(filename, "r")
+			i = 1
+			for line in file:
+				line = line.split("#", 1)[0].replace(",", " ")
+				for idRange in line.split():
+					ids = parseIDRange(idRange)
+					if ids == None:
+						self.errors.append(
+							"{0}:{1}: bad IDRange {2}".format(
+							rangeFile, i, idRange))
+						continue
+					idRanges.append(ids)
+				i += 1
 			file.close()
-		except IOError as err:
-			errors.append(errPrefix + str(err))
+
+		return idRanges
+
+	def excludeIDRanges(self, filename, idRanges, errPrefix):
+		if filename != "*":
+			try:
+				file = open(filename, "r")
+				file.close()
+			except IOError as err:
+				self.errors.append(errPrefix + str(err))
+				return
+
+		for idRange in idRanges:
+			ids = parseIDRange(idRange)
+			if ids == None:
+				self.errors.append(errPrefix +
+					"bad IDRange {0}".format(idRange))
+				return
+
+			x = self.excludedIDRanges.get(filename, None)
+			if x == None:
+				self.excludedIDRanges[filename] = []
+
+			self.excludedIDRanges[filename].append(ids)
+
+	def excludeIDRangeFiles(self, filename, rangeFiles, errPrefix):
+		if filename != "*":
+			try:
+				file = open(filename, "r")
+				file.close()
+			except IOError as err:
+				self.errors.append(errPrefix + str(err))
+				return
+
+		idRanges = self.readIDRangeFiles(rangeFiles, errPrefix)
+
+		x = self.excludedIDRanges.get(filename, None)
+		if x == None:
+			self.excludedIDRanges[filename] = []
+
+		self.excludedIDRanges[filename].extend(idRanges)
+
+	def includeIDRanges(self, filename, idRanges, errPrefix):
+		if filename != "*":
+			try:
+				file = open(filename, "r")
+				file.close()
+			except IOError as err:
+				self.errors.append(errPrefix + str(err))
+				return
+
+		for idRange in idRanges:
+			ids = parseIDRange(idRange)
+			if ids == None:
+				self.errors.append(errPrefix +
+					"bad IDRange {0}".format(idRange))
+				return
+
+			x = self.includedIDRanges.get(filename, None)
+			if x == None:
+				self.includedIDRanges[filename] = []
+
+			self.includedIDRanges[filename].append(ids)
+
+	def includeIDRangeFiles(self, filename, rangeFiles, errPrefix):
+		if filename != "*":
+			try:
+				file = open(filename, "r")
+				file.close()
+			except IOError as err:
+				self.errors.append(errPrefix + str(err))
+				return
+
+		idRanges = self.readIDRangeFiles(rangeFiles, errPrefix)
+
+		x = self.includedIDRanges.get(filename, None)
+		if x == None:
+			self.includedIDRanges[filename] = []
+
+		self.includedIDRanges[filename].extend(idRanges)
+
+	def excludeCountries(self, filename, countries, errPrefix):
+		if filename != "*":
+			try:
+				file = open(filename, "r")
+				file.close()
+			except IOError as err:
+				self.errors.append(errPrefix + str(err))
+				return
+
+		countryMap = {}
+		for country in countries:
+			country = country.upper()
+			countryMap[country] = True
+			abbrev = countryAbbrevs.get(country, "")
+			if abbrev != "":
+				countryMap[abbrev.upper()] = True
+			abbrev = countryAbbrevsInverse.get(country, "")
+			if abbrev != "":
+				countryMap[abbrev.upper()] = True
+
+		x = self.excludedCountries.get(filename, None)
+		if x == None:
+			self.excludedCountries[filename] = []
+
+		self.excludedCountries[filename].extend(countryMap.keys())
+
+	def includeCountries(self, filename, countries, errPrefix):
+		if filename != "*":
+			try:
+				file = open(filename, "r")
+				file.close()
+			except IOError as err:
+				self.errors.append(errPrefix + str(err))
+				return
+
+		countryMap = {}
+		for country in countries:
+			country = country.upper()
+			countryMap[country] = True
+			abbrev = countryAbbrevs.get(country, "")
+			if abbrev != "":
+				countryMap[abbrev.upper()] = True
+			abbrev = countryAbbrevsInverse.get(country, "")
+			if abbrev != "":
+				countryMap[abbrev.upper()] = True
+
+		x = self.includedCountries.get(filename, None)
+		if x == None:
+			self.includedCountries[filename] = []
+
+		self.includedCountries[filename].extend(countryMap.keys())
+
+	def parseConfigLine(self, configFile, i, line):
+		errPrefix = "{0}:{1}: ".format(configFile.name, i)
+		tokens = shlex.split(line, True)
+		if len(tokens) == 0:
 			return
 
-	for idRange in idRanges:
-		ids = idRange.split("-", 2)
-		if len(ids) == 1:
-			ids = [ids[0], ids[0]]
+		cmd = tokens[0].lower()
+		args = tokens[1:]
 
-		try:
-			ids = [int(ids[0]), int(ids[1])]
-		except ValueError:
-			errors.append(errPrefix + "bad IDRange {0}".format(idRange))
+		if len(args) == 0:
+			for opt in enable_options:
+				if opt.lower() == cmd:
+					self.options[opt] = True
+					return
+
+			for opt in disable_options:
+				if opt.lower() == cmd:
+					self.options[opt[2:]] = False
+					return
+
+			if cmd == "debug":
+				self.debug = True
+				return
+
+			if cmd == "verbose":
+				self.verbose = True
+				return
+
+		if cmd == "file" or cmd == "files":
+			for arg in args:
+				try:
+					file = open_file(arg)
+					self.files.append(file)
+				except IOError as err:
+					self.errors.append(errPrefix + str(err))
 			return
 
-		x = includedIDRanges.get(filename, None)
-		if x == None:
-			includedIDRanges[filename] = []
+		if cmd == "verbatim" or cmd == "verbatims":
+			for arg in args:
+				try:
+					verbatimFile = open_file(arg)
+					self.verbatim.append(verbatimFile)
+				except IOError as err:
+					self.errors.append(errPrefix + str(err))
+			return
 
-		includedIDRanges[filename].append(ids)
+		if cmd == "excludeid" or cmd == "excludeids":
+			filename = args[0]
+			idRanges = args[1:]
+			self.excludeIDRanges(filename, idRanges, errPrefix)
+			return
 
-def excludeCountries(filename, countries, errPrefix):
-	if filename != "*":
-		try:
-			file = open(filename, "r")
-			file.close()
-		except IOError as err:
-			errors.append(errPrefix + str(err))
+		if cmd == "includeid" or cmd == "includeids":
+			filename = args[0]
+			idRanges = args[1:]
+			self.includeIDRanges(filename, idRanges, errPrefix)
 			return
 
-	countryMap = {}
-	for country in countries:
-		country = country.upper()
-		countryMap[country] = True
-		abbrev = countryAbbrevs.get(country, "")
-		if abbrev != "":
-			countryMap[abbrev.upper()] = True
-		abbrev = countryAbbrevsInverse.get(country, "")
-		if abbrev != "":
-			countryMap[abbrev.upper()] = True
+		if cmd == "excludeidfile" or cmd == "excludeidfiles":
+			filename = args[0]
+			rangeFiles = args[1:]
+			self.excludeIDRangeFiles(filename, rangeFiles, errPrefix)
+			return
 
-	x = excludedCountries.get(filename, None)
-	if x == None:
-		excludedCountries[filename] = []
+		if cmd == "includeidfile" or cmd == "includeidfiles":
+			filename = args[0]
+			rangeFiles = args[1:]
+			self.includeIDRangeFiles(filename, rangeFiles, errPrefix)
+			return
 
-	excludedCountries[filename].extend(countryMap.keys())
+		if cmd == "excludecountry" or cmd == "excludecountries":
+			filename = args[0]
+			countries = args[1:]
+			self.excludeCountries(filename, countries, errPrefix)
+			return
 
-def includeCountries(filename, countries, errPrefix):
-	if filename != "*":
-		try:
-			file = open(filename, "r")
-			file.close()
-		except IOError as err:
-			errors.append(errPrefix + str(err))
+		if cmd == "includecountry" or cmd == "includecountries":
+			filename = args[0]
+			countries = args[1:]
+			self.includeCountries(filename, countries, errPrefix)
 			return
 
-	countryMap = {}
-	for country in countries:
-		country = country.upper()
-		countryMap[country] = True
-		abbrev = countryAbbrevs.get(country, "")
-		if abbrev != "":
-			countryMap[abbrev.upper()] = True
-		abbrev = countryAbbrevsInverse.get(country, "")
-		if abbrev != "":
-			countryMap[abbrev.upper()] = True
+		self.errors.append(errPrefix + "syntax error")
 
-	x = includedCountries.get(filename, None)
-	if x == None:
-		includedCountries[filename] = []
+	def process_config_file(self, configFile):
+		i = 1
+		for line in configFile:
+			self.parseConfigLine(configFile, i, line)
+			i += 1
 
-	includedCountries[filename].extend(countryMap.keys())
+	def read_user_line(self, file, i, line, userFilter):
+		parsed = parse_user_line(file, i, line, userFilter, self.warn)
+		if parsed is None:
+			return
 
-def parseConfigLine(configFile, i, line):
-	global verbatim, debug, verbose
+		i_dmr_id, fields = parsed
+		dmr_id, call, name, city, state, nick, country = fields
 
-	errPrefix = "{0}:{1}: ".format(configFile.name, i)
-	tokens = shlex.split(line, True)
-	if len(tokens) == 0:
-		return
+		user = self.users.get(i_dmr_id)
+		if user is None:
+			user = User(dmr_id)
+			if user.merge(call, name, city, state, nick, country):
+				self.users[i_dmr_id] = user
+			return
 
-	cmd = tokens[0].lower()
-	args = tokens[1:]
+		user.merge(call, name, city, state, nick, country)
 
-	if len(args) == 0:
-		for opt in enable_options:
-			if opt.lower() == cmd:
-				options[opt] = True
-				return
+	def read_user_files(self, files):
+		if self.jobs > 1 and \
+				all(os.path.isfile(file.name) for file in files):
+			self.read_user_files_partials(files)
+			return
 
-		for opt in disable_options:
-			if opt.lower() == cmd:
-				options[opt[2:]] = False
-				return
+		for file in files:
+			begin = time.time(), cpu_time()
+			userFilter = self.file_filter(file.name)
+			i = 1
+			for line in file:
+				self.read_user_line(file, i, line, userFilter)
+				i += 1
+			self.file_profile(file, begin)
+
+	# Pass the lines of messages collected while parsing a file to warn
+	def warn_messages(self, messages):
+		for message in messages.splitlines():
+			self.warn(message)
+
+	# Fold a partial map into users
+	def merge_partial_users(self, partial):
+		for dmr_id, fields in iteritems(partial):
+			user = self.users.get(dmr_id)
+			if user is None:
+				self.users[dmr_id] = User(*fields)
+			else:
+				user.merge(*fields[1:])
+
+	# Parse the files into per-file partial maps, then fold them into users
+	# in command-line order.  Since non-empty fields of later lines replace
+	# those of earlier lines, this gives exactly the same result as reading
+	# the files one line at a time.  The files are split into chunks, which
+	# are parsed in a pool of worker processes.
+	def read_user_files_partials(self, files):
+		chunks = []
+		chunkCounts = [0] * len(files)
+		for n, file in enumerate(files):
+			userFilter = self.file_filter(file.name)
+			fileChunks = file_chunks(file.name, self.jobs)
+			chunks += [chunk + (userFilter,) for chunk in fileChunks]
+			chunkCounts[n] = len(fileChunks)
+
+		pool = None
+		if len(chunks) > 1:
+			pool = multiprocessing.Pool(self.jobs)
+			results = pool.imap(parse_chunk, chunks)
+		else:
+			results = (parse_chunk(chunk) for chunk in chunks)
+
+		try:
+			for n, file in enumerate(files):
+				begin = time.time(), cpu_time()
+				partial = {}
+				messages = ""
+				for _ in range(chunkCounts[n]):
+					chunkPartial, chunkMessages = next(results)
+					partial = merge_partials(partial, chunkPartial)
+					messages += chunkMessages
+
+				self.warn_messages(messages)
+				self.merge_partial_users(partial)
+				self.file_profile(file, begin)
+		finally:
+			if pool != None:
+				pool.close()
+				pool.join()
+
+	def checkTitleCase(self):
+		newWordDict = {}
+
+		for user in itervalues(self.users):
+			findNewUpperCaseWords(user, newWordDict)
+
+		printNewUpperCaseWords(newWordDict)
+
+	def massage_users(self):
+		if self.jobs > 1 and len(self.users) > massageBatchSize:
+			self.massage_users_parallel()
+			return
 
-		if cmd == "debug":
-			debug = True
+		massage = compile_massage(self.options)
+		for dmr_id, user in iteritems(self.users):
+			massage(dmr_id, user)
+
+		if self.verbose:
+			print_memo_stats()
+
+	# Massage users in a pool of worker processes.  The records are split,
+	# in DMR ID order, into batches of massageBatchSize records, which are
+	# sent to the workers marshalled, and the results are stored back into
+	# the records.
+	def massage_users_parallel(self):
+		ids = [dmr_id for dmr_id, _ in self.sorted_users()]
+
+		def batches():
+			for start in range(0, len(ids), massageBatchSize):
+				batchIDs = ids[start:start+massageBatchSize]
+				yield marshal.dumps([(dmr_id,
+					self.users[dmr_id].fields())
+					for dmr_id in batchIDs])
+
+		pool = multiprocessing.Pool(self.jobs, init_massage_worker,
+			(self.options,))
+		try:
+			start = 0
+			for data in pool.imap(massage_batch, batches()):
+				massaged = marshal.loads(data)
+				for dmr_id, fields in zip(ids[start:], massaged):
+					self.users[dmr_id].set_fields(fields)
+				start += len(massaged)
+		finally:
+			pool.close()
+			pool.join()
+
+	def massage_user(self, dmr_id, user):
+		if self.compiledMassage == None:
+			self.compiledMassage = compile_massage(self.options)
+		self.compiledMassage(dmr_id, user)
+
+	# Count the records changed by each of massageSteps in
+	# transformCounts, for --profile.  The steps are applied to copies of
+	# the records, in a pass of their own, so that massage_users is timed
+	# as it runs without --profile.
+	def count_transforms(self):
+		for dmr_id, user in iteritems(self.users):
+			user = User(*user.fields())
+			for name, step in massageSteps:
+				before = user.fields()
+				step(self.options, dmr_id, user)
+				if user.fields() != before:
+					self.transformCounts[name] = \
+						self.transformCounts.get(name, 0) + 1
+
+	# Write output lines, in DMR ID order, as a binary userdb.  With
+	# --binaryPool, the city, state and country values are pooled, and
+	# with --binaryCalls, the records are also indexed by call sign.
+	# Returns the number of lines.
+	def output_binary(self, lines):
+		csvSize = [0]
+
+		def records():
+			for line in lines:
+				csvSize[0] += len(line) + 1
+				dmr_id, text = line.split(",", 1)
+				yield int(dmr_id), to_bytes(text)
+
+		out, tmpPath = self.open_output("wb")
+		try:
+			count, size = binary_users.write_binary(out, records(),
+				self.binaryPool, self.binaryCalls)
+		except:
+			abort_output(out, tmpPath)
+			raise
+
+		self.close_output(out, tmpPath)
+
+		if self.verbose:
+			if self.options["header"] and count > 0:
+				csvSize[0] += len(str(csvSize[0])) + 1
+			print("binary userdb:", binary_users.size_report(count, size,
+				csvSize[0]), file=sys.stderr)
+		return count
+
+	# Write the users to the output in DMR ID order.  The header's byte count
+	# is computed from the field lengths before any line is written, so the
+	# lines are streamed to the output rather than collected.
+	def output_users(self):
+		if self.binaryOutput:
+			self.output_binary(user.line()
+				for _, user in self.sorted_users())
 			return
 
-		if cmd == "verbose":
-			verbose = True
+		out, tmpPath = self.open_output()
+		try:
+			if self.options["header"] and len(self.users) > 0:
+				byteCount = 0
+				for user in itervalues(self.users):
+					byteCount += user.line_length()
+				out.write(str(byteCount) + "\n")
+
+			write_lines(out, (user.line()
+				for _, user in self.sorted_users()))
+		except:
+			abort_output(out, tmpPath)
+			raise
+
+		self.close_output(out, tmpPath)
+
+	# Yield (dmr_id, fileIndex, lineNumber, fields) for each accepted line
+	# of file, raising MergeError if the file is not sorted by DMR ID.
+	def sorted_user_lines(self, file, fileIndex):
+		userFilter = self.file_filter(file.name)
+		lastID = -1
+		i = 1
+		for line in file:
+			parsed = parse_user_line(file, i, line, userFilter, self.warn)
+			if parsed is not None:
+				dmr_id, fields = parsed
+				if dmr_id < lastID:
+					raise MergeError(
+						"{0}:{1} Input not sorted by DMR ID: {2}".format(
+						file.name, i, line.strip("\n")))
+				lastID = dmr_id
+				yield dmr_id, fileIndex, i, fields
+			i += 1
+
+	# Open the output: stdout, or a temporary file next to outputFile that
+	# close_output renames into place, so that the output file is always
+	# either the previous one or the complete new one.
+	# Returns the file and the temporary path, if any.
+	def open_output(self, mode="w"):
+		if self.outputFile == None:
+			if "b" in mode:
+				return getattr(sys.stdout, "buffer", sys.stdout), None
+			return std_file(sys.stdout), None
+
+		dirname = os.path.dirname(os.path.abspath(self.outputFile))
+		fd, tmpPath = tempfile.mkstemp(dir=dirname, suffix=".tmp",
+			prefix="." + os.path.basename(self.outputFile) + ".")
+		return open_file(fd, mode, outputBufferSize,
+			extension_compression(self.outputFile)), tmpPath
+
+	# Close the output, renaming it into place, and write its lookup
+	# index if writeIndex is set
+	def close_output(self, out, tmpPath):
+		out.flush()
+		if tmpPath == None:
 			return
 
-	if cmd == "file" or cmd == "files":
-		for arg in args:
+		out.close()
+		install_file(tmpPath, self.outputFile)
+
+		if self.writeIndex:
+			begin = stage_begin()
+			count = self.write_index()
+			self.stage_end("write_index", begin, count, count)
+
+	# Write the lookup index of the output file, read back from the file
+	# itself, so that it holds exactly what the file does.  The index
+	# records the identity of the output file, so that OutputIndex
+	# refuses it once the file changes.
+	# Returns the number of records.
+	def write_index(self):
+		indexFile = self.outputFile + indexSuffix
+		identity = file_identity(self.outputFile)
+
+		dirname = os.path.dirname(os.path.abspath(indexFile))
+		fd, tmpPath = tempfile.mkstemp(dir=dirname, suffix=".tmp",
+			prefix="." + os.path.basename(indexFile) + ".")
+		out = io.open(fd, "wb", outputBufferSize)
+		try:
+			out.write(struct.pack(indexHeaderFormat, indexMagic,
+				indexFormat, *identity))
+			count, _ = binary_users.write_binary(out,
+				output_records(self.outputFile), calls=True)
+			if file_identity(self.outputFile) != identity:
+				raise MergeError("{0}: changed while being indexed".format(
+					self.outputFile))
+		except:
+			abort_output(out, tmpPath)
+			raise
+
+		out.close()
+		install_file(tmpPath, indexFile)
+		return count
+
+	# Write lines to the output, prefixed by their byte count if the header
+	# option is set.  To count the bytes, the lines are spooled to a
+	# temporary file, so memory use does not depend on the number of lines.
+	# Returns the number of lines.
+	def output_lines(self, lines):
+		if self.binaryOutput:
+			return self.output_binary(lines)
+
+		out, tmpPath = self.open_output()
+		try:
+			if not self.options["header"]:
+				count = write_lines(out, lines)
+			else:
+				byteCount = 0
+				fd, spoolPath = tempfile.mkstemp()
+				os.remove(spoolPath)
+				spool = open_file(fd, "w+")
+				for line in lines:
+					byteCount += len(line) + 1
+					spool.write(line + "\n")
+
+				if byteCount > 0:
+					out.write(str(byteCount) + "\n")
+
+				spool.seek(0)
+				count = 0
+				while True:
+					block = spool.read(outputBufferSize)
+					if not block:
+						break
+					out.write(block)
+					count += block.count("\n")
+				spool.close()
+		except:
+			abort_output(out, tmpPath)
+			raise
+
+		self.close_output(out, tmpPath)
+		return count
+
+	# Merge the input files with a k-way merge on DMR ID, massaging each
+	# record and applying the verbatim files to it as soon as all of its
+	# lines have been seen.  All input and verbatim files must be sorted by
+	# DMR ID.  Memory use is independent of the size of the inputs.
+	def stream_users(self):
+		streams = [self.sorted_user_lines(file, fileIndex)
+			for fileIndex, file in enumerate(self.files + self.verbatim)]
+		firstVerbatim = len(self.files)
+		newWordDict = {}
+
+		def finished_users():
+			user = None
+			massaged = False
+			current = -1
+			for dmr_id, fileIndex, _, fields in heapq.merge(*streams):
+				if dmr_id != current:
+					if user is not None:
+						if not massaged:
+							self.massage_user(current, user)
+						yield user
+					user = None
+					massaged = False
+					current = dmr_id
+
+				if fileIndex >= firstVerbatim and not massaged:
+					if user is not None:
+						self.massage_user(dmr_id, user)
+					massaged = True
+
+				if user is None:
+					user = User(fields[0])
+					if not user.merge(*fields[1:]):
+						user = None
+				else:
+					user.merge(*fields[1:])
+
+			if user is not None:
+				if not massaged:
+					self.massage_user(current, user)
+				yield user
+
+		def lines():
+			for user in finished_users():
+				if self.verbose:
+					findNewUpperCaseWords(user, newWordDict)
+				yield user.line()
+
+		count = self.output_lines(lines())
+
+		if self.verbose:
+			print_memo_stats()
+			printNewUpperCaseWords(newWordDict)
+
+		return count
+
+	# Return a value that changes whenever the options or the list of files
+	# change, invalidating the saved incremental state.
+	def state_fingerprint(self):
+		return repr((stateFormat, version, sys.version,
+			sorted(self.options.items()),
+			[file.name for file in self.files],
+			[file.name for file in self.verbatim]))
+
+	# Return a value that changes whenever a file or its filter changes.
+	# Like make, it trusts the size and modification time of the file
+	# rather than reading it.
+	def file_stamp(self, file):
+		st = os.stat(file.name)
+		return (st.st_size, st.st_mtime,
+			repr(self.file_filter(file.name).fingerprint()))
+
+	def load_state(self):
+		try:
+			file = open(self.stateFile, "rb")
 			try:
-				file = open(arg, "r")
-				files.append(file)
-			except IOError as err:
-				errors.append(errPrefix + str(err))
-		return
+				# marshal.load reads a file in small pieces on Python 3,
+				# which is several times slower than reading it whole
+				state = marshal.loads(file.read())
+			finally:
+				file.close()
+		except (IOError, OSError, EOFError, ValueError, TypeError):
+			return None
+
+		if not isinstance(state, dict) or state.get("format") != stateFormat:
+			return None
+
+		return state
 
-	if cmd == "verbatim" or cmd == "verbatims":
-		for arg in args:
+	def save_state(self, state):
+		tmpPath = "{0}.{1}.tmp".format(self.stateFile, os.getpid())
+		try:
+			file = open(tmpPath, "wb")
 			try:
-				verbatimFile = open(arg, "r")
-				verbatim.append(verbatimFile)
-			except IOError as err:
-				errors.append(errPrefix + str(err))
-		return
+				file.write(marshal.dumps(state))
+			finally:
+				file.close()
+			os.rename(tmpPath, self.stateFile)
+		except (IOError, OSError) as err:
+			print("Error: saving state:", err, file=sys.stderr)
+
+	# Merge, massage and apply the verbatim partial maps to a single DMR ID.
+	# Returns the resulting User, or None if there is no record for the ID.
+	def remerge_user(self, dmr_id, partials, verbatimPartials):
+		user = None
+		for partial in partials:
+			fields = partial.get(dmr_id)
+			if fields is None:
+				continue
+			if user is None:
+				user = User(*fields)
+			else:
+				user.merge(*fields[1:])
 
-	if cmd == "excludeid" or cmd == "excludeids":
-		filename = args[0]
-		idRanges = args[1:]
-		excludeIDRanges(filename, idRanges, errPrefix)
-		return
+		if user is not None:
+			self.massage_user(dmr_id, user)
 
-	if cmd == "includeid" or cmd == "includeids":
-		filename = args[0]
-		idRanges = args[1:]
-		includeIDRanges(filename, idRanges, errPrefix)
-		return
+		for partial in verbatimPartials:
+			fields = partial.get(dmr_id)
+			if fields is None:
+				continue
+			if user is None:
+				user = User(*fields)
+			else:
+				user.merge(*fields[1:])
+
+		return user
+
+	# Produce users from the state saved by the previous run, re-merging only
+	# the records of DMR IDs whose lines changed in an input or verbatim
+	# file since then.  The state holds the final records, plus the stamp,
+	# line index and messages of each file.  Only the changed files are
+	# parsed.  The lines of the changed IDs in the other files are found
+	# by their line indexes.  Without usable state, the merge is done in
+	# full and the state saved.  The state is not rewritten if no file
+	# changed.  The output is still written in full by output_users, since
+	# a changed record can change the length of its line and the header's
+	# byte count.
+	def incremental_merge(self):
+		for file in self.files + self.verbatim:
+			if not os.path.isfile(file.name):
+				raise MergeError("Error: --incremental requires " +
+					"regular files: " + file.name)
+
+		fingerprint = self.state_fingerprint()
+		state = self.load_state()
+		if state != None and state["fingerprint"] != fingerprint:
+			state = None
+
+		# Return the entries of the files, their partial maps, which are
+		# None unless the whole file was parsed, and the changed DMR IDs.
+		# A changed file is indexed from its old line index, unless its
+		# filter changed too.
+		def read_files(fileList, oldEntries):
+			entries = []
+			partials = []
+			changed = set()
+			for n, file in enumerate(fileList):
+				stamp = self.file_stamp(file)
+				if oldEntries == None:
+					partial, messages, lineIndex = index_file(file.name,
+						self.file_filter(file.name))
+					entry = (stamp, lineIndex, messages)
+				elif oldEntries[n][0] == stamp:
+					entry = oldEntries[n]
+					partial = None
+				else:
+					oldIndex = oldEntries[n][1]
+					if oldEntries[n][0][2] != stamp[2]:
+						oldIndex = None
+					partial, messages, lineIndex = index_file(file.name,
+						self.file_filter(file.name), oldIndex)
+					entry = (stamp, lineIndex, messages)
+					changed |= changed_ids(oldEntries[n][1], lineIndex)
+				self.warn_messages(entry[2])
+				entries.append(entry)
+				partials.append(partial)
+			return entries, partials, changed
+
+		if state == None:
+			fileEntries, partials, _ = read_files(self.files, None)
+			for partial in partials:
+				self.merge_partial_users(partial)
+			self.massage_users()
+
+			verbatimEntries, partials, _ = read_files(self.verbatim, None)
+			for partial in partials:
+				self.merge_partial_users(partial)
+
+			if self.verbose:
+				print("incremental: full merge of", len(self.users),
+					"records", file=sys.stderr)
+		else:
+			fileEntries, partials, changed = read_files(self.files,
+				state["files"])
+			verbatimEntries, verbatimPartials, verbatimChanged = \
+				read_files(self.verbatim, state["verbatim"])
+			changed |= verbatimChanged
+
+			for dmr_id, fields in iteritems(state["users"]):
+				self.users[dmr_id] = User(*fields)
+
+			if fileEntries == state["files"] and \
+					verbatimEntries == state["verbatim"]:
+				if self.verbose:
+					print("incremental: no changes to", len(self.users),
+						"records", file=sys.stderr)
+				return
 
-	if cmd == "excludecountry" or cmd == "excludecountries":
-		filename = args[0]
-		countries = args[1:]
-		excludeCountries(filename, countries, errPrefix)
-		return
+			# Read the lines of the changed IDs in the files that weren't
+			# parsed in full
+			def fill_partials(fileList, entries, partials):
+				for n, file in enumerate(fileList):
+					if partials[n] is None:
+						partials[n] = read_indexed_partial(file.name,
+							self.file_filter(file.name), entries[n][1],
+							changed)
+
+			if len(changed) > 0:
+				fill_partials(self.files, fileEntries, partials)
+				fill_partials(self.verbatim, verbatimEntries,
+					verbatimPartials)
+
+			for dmr_id in changed:
+				user = self.remerge_user(dmr_id, partials,
+					verbatimPartials)
+				if user is None:
+					if dmr_id in self.users:
+						del self.users[dmr_id]
+				else:
+					self.users[dmr_id] = user
+
+			if self.verbose:
+				print("incremental: re-merged", len(changed), "of",
+					len(self.users), "records", file=sys.stderr)
+
+		self.save_state({
+			"format": stateFormat,
+			"fingerprint": fingerprint,
+			"files": fileEntries,
+			"verbatim": verbatimEntries,
+			"users": dict((dmr_id, user.fields())
+				for dmr_id, user in iteritems(self.users)),
+		})
+
+	# Record the resources used by a stage of run for --profile
+	def stage_end(self, name, begin, recordsIn, recordsOut):
+		if self.profileFormat == None:
+			return
 
-	if cmd == "includecountry" or cmd == "includecountries":
-		filename = args[0]
-		countries = args[1:]
-		includeCountries(filename, countries, errPrefix)
-		return
+		wall, cpu = begin
+		stage = {
+			"stage": name,
+			"wall": time.time() - wall,
+			"cpu": cpu_time() - cpu,
+			"recordsIn": recordsIn,
+			"recordsOut": recordsOut,
+			"peakRSS": None,
+			"tracemallocPeak": None,
+		}
+
+		if resource != None:
+			# ru_maxrss is in kilobytes on Linux, bytes on macOS
+			maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+			if sys.platform != "darwin":
+				maxrss *= 1024
+			stage["peakRSS"] = maxrss
+
+		if tracemalloc != None and tracemalloc.is_tracing():
+			stage["tracemallocPeak"] = tracemalloc.get_traced_memory()[1]
+
+		self.profileStages.append(stage)
+
+	# Record the time taken to read a file for --profile, so that the
+	# throughput of compressed files is reported apart from that of others
+	def file_profile(self, file, begin):
+		if self.profileFormat == None:
+			return
 
-	errors.append(errPrefix + "syntax error")
+		wall, cpu = begin
+		size = None
+		compression = None
+		if os.path.isfile(file.name):
+			size = os.path.getsize(file.name)
+			compression = input_compression(file.name)
+
+		self.fileProfiles.append({
+			"file": file.name,
+			"compression": compression,
+			"size": size,
+			"wall": time.time() - wall,
+			"cpu": cpu_time() - cpu,
+		})
+
+	# Return the number of lines in files, or None if it can't be counted
+	def count_lines(self, files):
+		if self.profileFormat == None:
+			return None
+
+		count = 0
+		for file in files:
+			if not os.path.isfile(file.name):
+				return None
+			f = open_file(file.name, "rb")
+			count += count_newlines(f, float("inf"))
+			f.close()
+		return count
+
+	def print_profile(self):
+		if self.profileFormat == "json":
+			json.dump({"stages": self.profileStages,
+				"files": self.fileProfiles,
+				"transforms": self.transformCounts}, sys.stderr,
+				indent=1, sort_keys=True)
+			print(file=sys.stderr)
+			return
+
+		def size(n):
+			if n == None:
+				return "-"
+			return "{0:.1f}M".format(n / (1024.0 * 1024))
+
+		def count(n):
+			if n == None:
+				return "-"
+			return str(n)
+
+		print("{0:<20} {1:>9} {2:>9} {3:>10} {4:>10} {5:>9} {6:>9}".format(
+			"stage", "wall", "cpu", "in", "out", "peakRSS", "tracemem"),
+			file=sys.stderr)
+		for stage in self.profileStages:
+			print("{0:<20} {1:>9.3f} {2:>9.3f} {3:>10} {4:>10} {5:>9} {6:>9}".format(
+				stage["stage"], stage["wall"], stage["cpu"],
+				count(stage["recordsIn"]), count(stage["recordsOut"]),
+				size(stage["peakRSS"]), size(stage["tracemallocPeak"])),
+				file=sys.stderr)
 
-def process_config_file(configFile):
-	i = 1
-	for line in configFile:
-		parseConfigLine(configFile, i, line)
-		i += 1
+		# Throughput is in megabytes of the file as stored, per second
+		def rate(profile):
+			if profile["size"] == None or profile["wall"] <= 0:
+				return "-"
+			return "{0:.1f}".format(
+				profile["size"] / (1024.0 * 1024) / profile["wall"])
+
+		if len(self.fileProfiles) > 0:
+			print(file=sys.stderr)
+			print("{0:<20} {1:>11} {2:>9} {3:>9} {4:>9} {5:>9}".format(
+				"file", "compression", "size", "wall", "cpu", "MB/s"),
+				file=sys.stderr)
+			for profile in self.fileProfiles:
+				compression = profile["compression"] or "-"
+				print("{0:<20} {1:>11} {2:>9} {3:>9.3f} {4:>9.3f} {5:>9}".format(
+					os.path.basename(profile["file"]), compression,
+					size(profile["size"]), profile["wall"], profile["cpu"],
+					rate(profile)), file=sys.stderr)
+
+		if len(self.transformCounts) > 0:
+			print(file=sys.stderr)
+			print("{0:<20} {1:>10}".format("transform", "changed"),
+				file=sys.stderr)
+			for name, _ in massageSteps:
+				print("{0:<20} {1:>10}".format(name,
+					self.transformCounts.get(name, 0)), file=sys.stderr)
 
-def process_args():
-	global verbatim, debug, verbose
+# The argparse type of the input file arguments, opened by open_file.
+# Standard input can't be sniffed without consuming it, so it is never
+# decompressed.
+def input_file(name):
+	if name == "-":
+		return std_file(sys.stdin)
 
+	try:
+		return open_file(name)
+	except IOError as err:
+		raise argparse.ArgumentTypeError(
+			"can't open '{0}': {1}".format(name, err))
+
+# Parse the command line arguments, argv or sys.argv[1:], and return a
+# Merger set up by them.  Exits if they are in error.
+# Return the Merger set up by the merge_users.py arguments argv, or by
+# those of the command line.  Errors are printed and end the program,
+# unless quiet is set, when they raise MergeError, and nothing is printed
+# even with --verbose.
+def process_args(argv=None, quiet=False):
 	parser = argparse.ArgumentParser(description="Merge userdb files")
 
 	for opt in optionList:
@@ -2792,18 +5000,18 @@ def process_args():
 			help="Do not " + lowerFirst(opt["help"]))
 
 	parser.add_argument("--config", nargs=1, metavar="configfilename",
-		action="store", type=argparse.FileType("r"),
+		action="store", type=input_file,
 		help="A file containing configuration flags and options")
 
 	parser.add_argument("--verbatim", "--verbatims", nargs="+",
 		metavar="filename", action="append",
-		type=argparse.FileType("r"),
+		type=input_file,
 		help="A filename whose fields are merged without " +
 			"modification. These files are merged after field " +
 			"fixups have been applied.")
 
 	parser.add_argument("files", metavar="filename", nargs="*",
-		type=argparse.FileType("r"), help="A filename to be merged. " +
+		type=input_file, help="A filename to be merged. " +
 		"Files are merged in the order that they are named in this " +
 		"list. Fields from later files take precedence over " +
 		"(replace) those of previous files.")
@@ -2817,6 +5025,53 @@ def process_args():
 	parser.add_argument("--version", help="Output the current version.",
 		action="store_true")
 
+	parser.add_argument("--binary", help="Write the output as a " +
+		"binary userdb, with a sorted table of DMR IDs for binary " +
+		"search, instead of CSV. binary_users.py reads it.",
+		action="store_true")
+
+	parser.add_argument("--binaryPool", help="Write the output as a " +
+		"binary userdb that stores each distinct city, state and " +
+		"country once, in a string pool.", action="store_true")
+
+	parser.add_argument("--binaryCalls", help="Write the output as a " +
+		"binary userdb that is also indexed by call sign, for " +
+		"lookups by call sign from binary_users.map_binary().",
+		action="store_true")
+
+	parser.add_argument("--index", help="Also write filename.idx, " +
+		"an index of the output file named by --output filename, " +
+		"from which merge_users.py lookup --index filename answers " +
+		"without merging.", action="store_true")
+
+	parser.add_argument("--sortedInputs", "--sorted-inputs",
+		help="All input and verbatim files are sorted by DMR ID. " +
+			"The files are merged and output as they are read, " +
+			"using memory independent of the size of the files.",
+		action="store_true")
+
+	parser.add_argument("--incremental", nargs=1, metavar="statefile",
+		help="Save the merged records and an index of the lines of " +
+			"each file in statefile. On later runs, only the files " +
+			"whose size or modification time changed are read, and " +
+			"only the records of DMR IDs whose lines changed are " +
+			"merged again. The output is still written in full.")
+
+	parser.add_argument("-j", "--jobs", nargs=1, metavar="N", type=int,
+		help="Use N worker processes to parse the input files " +
+			"and to massage their records.")
+
+	parser.add_argument("--profile", choices=["table", "json"],
+		help="Report the time, records and peak RSS of each stage, " +
+			"and the number of records changed by each transform, " +
+			"to stderr as a table or as JSON.")
+
+	parser.add_argument("--profileMemory", action="store_true",
+		help="With --profile, also report the peak memory allocated " +
+			"by each stage, traced by tracemalloc (Python 3 only). " +
+			"Tracing slows the run, so take the times of the stages " +
+			"from a separate run without it.")
+
 	parser.add_argument("--excludeID", "--excludeIDs", nargs="+",
 		action="append", metavar=("filename", "id1[-id2]"),
 		help="This option only applies to the named file. " +
@@ -2829,6 +5084,20 @@ def process_args():
 			"Only records with a dmr-id matching id1 or within " +
 			"the range id1-id2 are included in the output")
 
+	parser.add_argument("--excludeIDFile", "--excludeIDFiles", nargs="+",
+		action="append", metavar=("filename", "rangefile"),
+		help="This option only applies to the named file. " +
+			"Any records with a dmr-id matching an id or within " +
+			"an id range listed in rangefile are excluded from " +
+			"the output")
+
+	parser.add_argument("--includeIDFile", "--includeIDFiles", nargs="+",
+		action="append", metavar=("filename", "rangefile"),
+		help="This option only applies to the named file. " +
+			"Only records with a dmr-id matching an id or within " +
+			"an id range listed in rangefile are included in " +
+			"the output")
+
 	parser.add_argument("--excludeCountry", "--excludeCountries",
 		nargs="+", action="append", metavar=("filename", "countryname"),
 		help="This option only applies to the named file. " +
@@ -2841,65 +5110,62 @@ def process_args():
 			"Only records with a country name matching " +
 			"countryname are included in the output")
 
+	parser.add_argument("--output", nargs=1, metavar="filename",
+		help="Write the output to filename instead of stdout. " +
+			"The file is replaced only once it is complete.")
+
+	# "-o OptionName" is the obsolete form of "--optionName"
 	parser.add_argument("-o", nargs=1, dest="options",
 		action="append", choices=enable_options + disable_options,
 		help=argparse.SUPPRESS)
 
-	args = parser.parse_args()
-
-	debug = False
-	if args.debug:
-		debug = True
-
-	verbose = False
-	if args.verbose or args.debug:
-		verbose = True
+	args = parser.parse_args(argv)
 
 	if args.version:
 		print(version)
 		sys.exit(0)
 
-	for _, abbrevStates in stateAbbrevsByCountry.iteritems():
-		stateAbbrevs.update(abbrevStates)
+	merger = Merger(sortedInputs=args.sortedInputs,
+		binaryOutput=args.binary, binaryPool=args.binaryPool,
+		binaryCalls=args.binaryCalls, writeIndex=args.index,
+		profileFormat=args.profile,
+		profileMemory=args.profileMemory, verbose=args.verbose,
+		debug=args.debug)
+	errors = merger.errors
 
-	for state, abbrev in stateAbbrevs.items():
-		stateAbbrevs[state.upper()] = abbrev
-		existing = stateAbbrevsInverse.get(abbrev.upper(), "")
-		if existing != "":
-			print("Error: duplicate abbreviation:", abbrev,
-				file=sys.stderr)
-		stateAbbrevsInverse[abbrev.upper()] = state
+	if args.incremental != None:
+		if merger.sortedInputs:
+			errors.append("--incremental cannot be used with " +
+				"--sortedInputs")
+		merger.stateFile = args.incremental[0]
 
-	for _, abbrevStates in alternateStateAbbrevsByCountry.iteritems():
-		for state, abbrev in abbrevStates.items():
-			stateAbbrevs[state.upper()] = abbrev
-
-	for country, abbrev in countryAbbrevs.items():
-		countryAbbrevs[country.upper()] = abbrev
-		existing = countryAbbrevsInverse.get(abbrev.upper(), "")
-		if existing != "":
-			print("Error: duplicate abbreviation:", abbrev,
-				file=sys.stderr)
-		countryAbbrevsInverse[abbrev.upper()] = country
+	if args.jobs != None:
+		if args.jobs[0] < 1:
+			errors.append("--jobs must be at least 1")
+		merger.jobs = args.jobs[0]
 
-	for country, abbrev in alternateCountryAbbrevs.items():
-		countryAbbrevs[country.upper()] = abbrev
-
-	for abbrev, country in inverseCountryAbbrevs.items():
-		countryAbbrevsInverse[abbrev.upper()] = country
-
-	for opt in optionList:
-		options[opt["name"]] = opt["default"]
+	options = merger.options
 
 	if args.config != None:
 		for configFile in args.config:
-			process_config_file(configFile)
+			merger.process_config_file(configFile)
+
+	if quiet:
+		merger.verbose = False
+		merger.debug = False
 
 	for opt in optionList:
 		name = opt["name"]
 		if vars(args)[name] != None:
 			options[name] = vars(args)[name]
 
+	if args.output != None:
+		merger.outputFile = args.output[0]
+		if lzma == None and \
+				extension_compression(merger.outputFile) == "xz":
+			errors.append("{0}: xz files need the lzma module".format(
+				merger.outputFile))
+
 	if args.options != None:
 		flatOpts = [lowerFirst(opt)
 				for sublist in args.options for opt in sublist]
@@ -2907,7 +5173,7 @@ def process_args():
 			name = lowerFirst(opt["name"])
 			if name in flatOpts:
 				options[name] = True
-				if verbose:
+				if merger.verbose:
 					print("'-o " + upperFirst(name) +
 						"' is obsolete. Use '--" +
 						name + "'.", file=sys.stderr)
@@ -2915,49 +5181,73 @@ def process_args():
 			noname = "no" + upperFirst(name)
 			if noname in flatOpts:
 				options[lowerFirst(name)] = False
-				if verbose:
+				if merger.verbose:
 					print("'-o " + upperFirst(noname) +
 						"' is obsolete. Use '--" +
 						noname +"'.", file=sys.stderr)
 
 	if args.verbatim != None:
 		for verbatimFiles in args.verbatim:
-			verbatim += verbatimFiles
+			merger.verbatim += verbatimFiles
 
 	errPrefix = ""
 
 	if args.excludeID != None:
-		filename = args.excludeID[0][0]
-		idRanges = args.excludeID[0][1:]
-		excludeIDRanges(filename, idRanges, errPrefix)
+		for excludeID in args.excludeID:
+			filename = excludeID[0]
+			idRanges = excludeID[1:]
+			merger.excludeIDRanges(filename, idRanges, errPrefix)
 
 	if args.includeID != None:
-		filename = args.includeID[0][0]
-		includeIDRanges(filename, idRanges, errPrefix)
+		for includeID in args.includeID:
+			filename = includeID[0]
+			idRanges = includeID[1:]
+			merger.includeIDRanges(filename, idRanges, errPrefix)
+
+	if args.excludeIDFile != None:
+		for excludeIDFile in args.excludeIDFile:
+			filename = excludeIDFile[0]
+			rangeFiles = excludeIDFile[1:]
+			merger.excludeIDRangeFiles(filename, rangeFiles, errPrefix)
+
+	if args.includeIDFile != None:
+		for includeIDFile in args.includeIDFile:
+			filename = includeIDFile[0]
+			rangeFiles = includeIDFile[1:]
+			merger.includeIDRangeFiles(filename, rangeFiles, errPrefix)
 
 	if args.excludeCountry != None:
-		filename = args.excludeCountry[0][0]
-		countries = args.excludeCountry[0][1:]
-		excludeCountries(filename, countries, errPrefix)
+		for excludeCountry in args.excludeCountry:
+			filename = excludeCountry[0]
+			countries = [arg_string(country)
+				for country in excludeCountry[1:]]
+			merger.excludeCountries(filename, countries, errPrefix)
 
 	if args.includeCountry != None:
-		filename = args.includeCountry[0][0]
-		countries = args.includeCountry[0][1:]
-		includeCountries(filename, countries, errPrefix)
+		for includeCountry in args.includeCountry:
+			filename = includeCountry[0]
+			countries = [arg_string(country)
+				for country in includeCountry[1:]]
+			merger.includeCountries(filename, countries, errPrefix)
+
+	merger.files.extend(args.files)
 
-	files.extend(args.files)
+	if merger.writeIndex and merger.outputFile == None:
+		errors.append("--index needs an output file, --output filename")
 
 	if len(errors) > 0:
+		if quiet:
+			raise MergeError("\n".join(errors))
 		for error in errors:
 			print(error, file=sys.stderr)
 		sys.exit(1)
 
-	if verbose:
+	if merger.verbose:
 		for opt in sorted(options):
 			print(opt, options[opt], file=sys.stderr)
 
-		for filename in excludedIDRanges:
-			for range in excludedIDRanges[filename]:
+		for filename in merger.excludedIDRanges:
+			for range in merger.excludedIDRanges[filename]:
 				if range[0] == range[1]:
 					s = str(range[0])
 				else:
@@ -2965,8 +5255,8 @@ def process_args():
 
 				print("excludeID", filename, s, file=sys.stderr)
 
-		for filename in includedIDRanges:
-			for range in includedIDRanges[filename]:
+		for filename in merger.includedIDRanges:
+			for range in merger.includedIDRanges[filename]:
 				if range[0] == range[1]:
 					s = str(range[0])
 				else:
@@ -2974,59 +5264,435 @@ def process_args():
 
 				print("includeID", filename, s, file=sys.stderr)
 
-		for filename in excludedCountries:
-			for country in excludedCountries[filename]:
+		for filename in merger.excludedCountries:
+			for country in merger.excludedCountries[filename]:
 				print("excludeCountry", filename, country,
 					file=sys.stderr)
 
-		for filename in includedCountries:
-			for country in includedCountries[filename]:
+		for filename in merger.includedCountries:
+			for country in merger.includedCountries[filename]:
 				print("includeCountry", filename, country,
 					file=sys.stderr)
 
-		for file in files:
+		for file in merger.files:
 			print("file:", file.name, file=sys.stderr)
 
-		for file in verbatim:
+		for file in merger.verbatim:
 			print("verbatim:", file.name, file=sys.stderr)
 
-def read_user_files(files):
-	for file in files:
-		i = 1
-		for line in file:
-			read_user_line(file, i, line)
-			i += 1
+	return merger
 
-def output_users():
-	byteCount = 0
-	lines = [""]
-	for i, u in sorted([(int(i), u) for i, u in users.iteritems()]):
-		line = "{0},{1},{2},{3},{4},{5},{6}".format(
-			u["id"], u["call"], u["name"], u["city"], u["state"],
-			u["nick"], u["country"])
+# merge_users.py serve merges the files once, keeps the records in memory
+# and answers lookups by DMR ID or call sign over HTTP, on a TCP port or
+# a Unix socket, with JSON replies.  The input files are watched, and
+# when one changes the files are merged again in a background thread.
+# The new UserIndex replaces the old one with a single assignment, so a
+# request is always answered from one complete index.
 
-		byteCount += len(line) + 1
-		lines.append(line)
+defaultListen = "127.0.0.1:8380"
+defaultReload = 5
 
-	lines[0] = str(byteCount)
+# Serializes the lines that the threads of serve write to stderr
+logLock = threading.Lock()
 
-	if len(lines) == 1 or not options["header"]:
-		lines = lines[1:]
+# Write message to stderr as one line, so that the lines of concurrent
+# requests are neither interleaved nor lost
+def log_line(message):
+	with logLock:
+		sys.stderr.write(message + "\n")
+		sys.stderr.flush()
 
-	for line in lines:
-		print(line)
+# A field as a JSON string.  Its bytes are taken to be UTF-8.
+def json_string(field):
+	return to_bytes(field).decode("utf-8", "replace")
 
-def main():
-	process_args()
+def user_json(dmr_id, user):
+	return {
+		"id": dmr_id,
+		"call": json_string(user.call),
+		"name": json_string(user.name),
+		"city": json_string(user.city),
+		"state": json_string(user.state),
+		"nick": json_string(user.nick),
+		"country": json_string(user.country),
+	}
+
+# Return the (name, size, mtime) of each of the files, or None if one of
+# them is not a regular file and so can't be watched
+def file_stamps(names):
+	stamps = []
+	for name in names:
+		if not os.path.isfile(name):
+			return None
+		st = os.stat(name)
+		stamps.append((name, st.st_size, st.st_mtime))
+	return stamps
+
+# The merged records of a Merger, indexed by DMR ID (the Merger's users)
+# and by upper-case call sign
+class UserIndex(object):
+	def __init__(self, merger, stamps, buildSeconds, warnings):
+		self.users = merger.users
+		self.calls = merger.call_index()
+
+		self.stamps = stamps
+		self.built = time.time()
+		self.buildSeconds = buildSeconds
+		self.warnings = warnings
+
+	def __len__(self):
+		return len(self.users)
+
+	def by_id(self, dmr_id):
+		return self.users.get(dmr_id)
+
+	# Return the (dmr_id, user) pairs with the call sign, in ID order
+	def by_call(self, call):
+		ids = self.calls.lookup(call)
+		return [(dmr_id, self.users[dmr_id]) for dmr_id in ids]
+
+# Builds the UserIndex of the merge given by the merge_users.py arguments
+# argv, and rebuilds it whenever the files change
+class LookupService(object):
+	def __init__(self, argv, reloadInterval):
+		self.argv = argv
+		self.reloadInterval = reloadInterval
+		self.index = None
+		self.generation = 0
+		self.verbose = False
+
+	# Merge the files into a new UserIndex.  A reload prints nothing, but
+	# counts the warnings about the lines of the files, since the other
+	# threads are answering requests.
+	def build(self, reloading=False):
+		begin = time.time()
+		merger = process_args(self.argv, reloading)
+		if not reloading:
+			self.verbose = merger.verbose
+
+		warnings = []
+		def warn(message):
+			if not reloading:
+				print_warning(message)
+			warnings.append(message)
+		merger.warn = warn
+
+		names = [file.name for file in merger.files + merger.verbatim]
+		stamps = file_stamps(names)
+		try:
+			merger.merge()
+		finally:
+			merger.close_files()
+		return UserIndex(merger, stamps, time.time() - begin,
+			len(warnings))
+
+	def start(self):
+		self.index = self.build()
+		self.generation = 1
+		if self.reloadInterval <= 0:
+			return
 
-	read_user_files(files)
-	massage_users()
-	read_user_files(verbatim)
+		if self.index.stamps == None:
+			print("serve: not reloading, since an input is not a " +
+				"regular file", file=sys.stderr)
+			return
+
+		watcher = threading.Thread(target=self.watch)
+		watcher.daemon = True
+		watcher.start()
 
+	# Merge again whenever the size or mtime of a file changes.  If the
+	# merge fails, the old index is kept.
+	def watch(self):
+		while True:
+			time.sleep(self.reloadInterval)
+			names = [name for name, _, _ in self.index.stamps]
+			try:
+				stamps = file_stamps(names)
+				if stamps == None or stamps == self.index.stamps:
+					continue
+				index = self.build(True)
+			except SystemExit:
+				log_line("serve: reload failed")
+				continue
+			except (MergeError, IOError, OSError) as err:
+				log_line("serve: reload failed: {0}".format(err))
+				continue
+
+			if index.stamps == None:
+				continue
+
+			self.index = index
+			self.generation += 1
+			if self.verbose or index.warnings > 0:
+				summary = "serve: reloaded {0} records in {1:.3f}s".format(
+					len(index), index.buildSeconds)
+				if index.warnings > 0:
+					summary += ", {0} warnings".format(index.warnings)
+				log_line(summary)
+
+	def status(self):
+		index = self.index
+		return {
+			"records": len(index),
+			"generation": self.generation,
+			"built": index.built,
+			"buildSeconds": index.buildSeconds,
+			"warnings": index.warnings,
+			"version": version,
+		}
+
+# Answers GET /id/<DMR ID>, /call/<call sign> and /status.  Connections
+# are kept alive, so a client can send any number of requests on one.
+class LookupHandler(http_server.BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	server_version = "merge_users/" + version
+
+	# Send each reply in one write, without waiting for the ACK of the
+	# previous one
+	wbufsize = -1
+
+	def setup(self):
+		# A Unix socket's client address is not a (host, port) tuple
+		self.disable_nagle_algorithm = isinstance(self.client_address,
+			tuple)
+		http_server.BaseHTTPRequestHandler.setup(self)
+
+	def do_GET(self):
+		service = self.server.service
+		path = self.path.split("?", 1)[0]
+		parts = path.strip("/").split("/", 1)
+
+		if len(parts) == 2 and parts[0] == "id":
+			try:
+				dmr_id = int(parts[1])
+			except ValueError:
+				self.reply(400, {"error": "bad DMR ID"})
+				return
+			user = service.index.by_id(dmr_id)
+			if user is None:
+				self.reply(404, {"error": "DMR ID not found"})
+				return
+			self.reply(200, user_json(dmr_id, user))
+			return
+
+		if len(parts) == 2 and parts[0] == "call":
+			call = url_string(parts[1])
+			users = service.index.by_call(call)
+			if len(users) == 0:
+				self.reply(404, {"error": "call sign not found"})
+				return
+			self.reply(200, {
+				"call": json_string(call.upper()),
+				"users": [user_json(dmr_id, user)
+					for dmr_id, user in users],
+			})
+			return
+
+		if parts == ["status"]:
+			self.reply(200, service.status())
+			return
+
+		self.reply(404, {"error": "not found"})
+
+	def reply(self, code, value):
+		body = json.dumps(value, sort_keys=True).encode("utf-8")
+		self.send_response(code)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		if self.server.service.verbose:
+			log_line("serve: " + format % args)
+
+class LookupHTTPServer(socketserver.ThreadingMixIn, http_server.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+if hasattr(socketserver, "UnixStreamServer"):
+	class LookupUnixServer(socketserver.ThreadingMixIn,
+			socketserver.UnixStreamServer):
+		daemon_threads = True
+
+# Return (host, port) for a "host:port" address, or the path of a Unix
+# socket for any other
+def listen_address(address):
+	if "/" not in address and ":" in address:
+		host, port = address.rsplit(":", 1)
+		try:
+			return host, int(port)
+		except ValueError:
+			pass
+	return address
+
+def serve(argv):
+	parser = argparse.ArgumentParser(prog="merge_users.py serve",
+		description="Merge userdb files and answer lookups of the " +
+			"merged records by DMR ID (GET /id/ID) or call sign " +
+			"(GET /call/CALL) with JSON replies. GET /status " +
+			"describes the records.",
+		epilog="The other arguments are those of merge_users.py.")
+
+	parser.add_argument("--listen", metavar="address",
+		default=defaultListen,
+		help="Listen on address, host:port or the path of a Unix " +
+			"socket. The default is " + defaultListen + ".")
+
+	parser.add_argument("--reload", metavar="seconds", type=float,
+		default=defaultReload,
+		help="Check the files for changes every seconds seconds, " +
+			"merging them again when one changes. 0 disables " +
+			"reloading. The default is {0}.".format(defaultReload))
+
+	args, mergeArgv = parser.parse_known_args(argv)
+
+	address = listen_address(args.listen)
+	if not isinstance(address, tuple) and \
+			not hasattr(socketserver, "UnixStreamServer"):
+		print("serve: Unix sockets are not supported", file=sys.stderr)
+		sys.exit(1)
+
+	service = LookupService(mergeArgv, args.reload)
+	try:
+		service.start()
+	except MergeError as err:
+		print(err, file=sys.stderr)
+		sys.exit(1)
+
+	try:
+		if isinstance(address, tuple):
+			server = LookupHTTPServer(address, LookupHandler)
+		else:
+			# Replace the socket of a server that has exited
+			if os.path.exists(address) and \
+					stat.S_ISSOCK(os.stat(address).st_mode):
+				os.remove(address)
+			server = LookupUnixServer(address, LookupHandler)
+	except (IOError, OSError) as err:
+		print("serve: {0}: {1}".format(args.listen, err),
+			file=sys.stderr)
+		sys.exit(1)
+
+	server.service = service
+	if service.verbose:
+		print("serve:", len(service.index), "records on", args.listen,
+			file=sys.stderr)
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		if not isinstance(address, tuple):
+			try:
+				os.remove(address)
+			except OSError:
+				pass
+
+# Print the merged records of each DMR ID, call sign or call sign prefix,
+# from the lookup index of an output file, or by merging the files given
+# by the merge_users.py arguments following "--"
+def lookup(argv):
+	parser = argparse.ArgumentParser(prog="merge_users.py lookup",
+		usage="%(prog)s [-h] [-v] [--index filename] [--limit N] " +
+			"id|call [id|call ...] " +
+			"[-- [merge_users.py arguments] filename [filename ...]]",
+		description="Print the merged records of DMR IDs or call " +
+			"signs. A call sign ending in * matches all call signs " +
+			"starting with it, as in W1A*.")
+
+	parser.add_argument("keys", nargs="+", metavar="id|call")
+	parser.add_argument("--index", metavar="filename",
+		help="Look up the records in the index of the output file " +
+			"filename, written by merge_users.py --index --output " +
+			"filename, instead of merging.")
+	parser.add_argument("--limit", type=int, metavar="N",
+		help="Print the records of at most N call signs per prefix.")
+	parser.add_argument("-v", "--verbose", action="store_true",
+		help="Report the time taken by the lookups.")
+
+	mergeArgv = []
+	if "--" in argv:
+		mergeArgv = argv[argv.index("--")+1:]
+		argv = argv[:argv.index("--")]
+	args = parser.parse_args([arg_string(arg) for arg in argv])
+	if (args.index == None) == (len(mergeArgv) == 0):
+		parser.error("give either --index filename, or the files to " +
+			"merge following --")
+
+	if args.index != None:
+		try:
+			index = OutputIndex(args.index)
+		except MergeError as err:
+			print(err, file=sys.stderr)
+			sys.exit(1)
+		print_lookup(index, args.keys, args.limit, args.verbose)
+		index.close()
+		return
+
+	merger = process_args(mergeArgv)
+	try:
+		merger.merge()
+	except MergeError as err:
+		print(err, file=sys.stderr)
+		sys.exit(1)
+	finally:
+		merger.close_files()
+
+	begin = time.time()
+	callIndex = merger.call_index()
+	if merger.verbose:
+		print("lookup: indexed {0} call signs in {1:.3f}s".format(
+			len(callIndex), time.time() - begin), file=sys.stderr)
+
+	print_lookup(merger, args.keys, args.limit,
+		args.verbose or merger.verbose)
+
+# Print the records of keys found by index.lookup, which is a Merger or
+# an OutputIndex.  Exits with status 1 if a key is not found.
+def print_lookup(index, keys, limit, verbose=False):
+	begin = time.time()
+	found = [index.lookup(key, limit) for key in keys]
 	if verbose:
-		checkTitleCase()
+		print("lookup: {0} keys in {1:.6f}s".format(len(keys),
+			time.time() - begin), file=sys.stderr)
+
+	out = std_file(sys.stdout)
+	missing = False
+	for key, users in zip(keys, found):
+		if len(users) == 0:
+			print("{0}: not found".format(key), file=sys.stderr)
+			missing = True
+		for _, user in users:
+			out.write(user.line() + "\n")
+	out.flush()
+	if missing:
+		sys.exit(1)
+
+def main():
+	# Messages quote input lines, so they are written as bytes too
+	sys.stderr = std_file(sys.stderr)
+
+	if sys.argv[1:2] == ["serve"]:
+		serve(sys.argv[2:])
+		return
 
-	output_users()
+	if sys.argv[1:2] == ["lookup"]:
+		lookup(sys.argv[2:])
+		return
+
+	begin = stage_begin()
+	merger = process_args()
+	merger.stage_end("process_args", begin, None, None)
+
+	try:
+		merger.run()
+	except (MergeError, IOError, OSError) as err:
+		print(err, file=sys.stderr)
+		sys.exit(1)
 
 if __name__ == '__main__':
 	main()
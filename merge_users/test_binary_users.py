@@ -0,0 +1,235 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Tests of binary_users.py.  Run them with
+#
+#	python -m unittest discover
+#
+# from this directory, under Python 2 or Python 3.
+
+# MIT License
+#
+# Copyright 2018 Dale Farnsworth
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import binary_users as bu
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+
+# Records with empty fields, shared city, state and country values, and
+# call signs differing only in case
+records = [
+	(1023001, b"K1ABC,John Smith,Dallas,TX,John,US"),
+	(1023002, b"k1abc,Jane Smith,Dallas,TX,,US"),
+	(1023003, b",No Call,Austin,TX,,US"),
+	(2345678, b"DL1XYZ,Hans Meyer,Berlin,,Hans,DE"),
+	(3100000, b"K1AB,Bob Jones,Dallas,TX,,US"),
+	(3100001, b"W1AW,,,,,"),
+]
+
+def csv_data(header=True):
+	lines = [str(dmr_id).encode("ascii") + b"," + text + b"\n"
+		for dmr_id, text in records]
+	data = b"".join(lines)
+	if header:
+		data = str(len(data)).encode("ascii") + b"\n" + data
+	return data
+
+def run_script(name, args, cwd):
+	command = [sys.executable, os.path.join(testDir, name)]
+	proc = subprocess.Popen(command + args, cwd=cwd,
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	out, err = proc.communicate()
+	return proc.returncode, out, err
+
+# Write records as each format version, read them back with
+# read_binary and map_binary, and check them with verify
+class RoundTripTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def path(self, name):
+		return os.path.join(self.dir, name)
+
+	def write(self, name, data):
+		file = open(self.path(name), "wb")
+		file.write(data)
+		file.close()
+
+	# Write the binary userdb of records after prefix, checking its size
+	def write_binary(self, name, prefix, pooled, calls):
+		file = open(self.path(name), "wb")
+		file.write(prefix)
+		count, size = bu.write_binary(file, iter(records), pooled, calls)
+		file.close()
+		self.assertEqual(count, len(records))
+		self.assertEqual(len(prefix) + size,
+			os.path.getsize(self.path(name)))
+
+	def check_users(self, users, version):
+		self.assertEqual(users.version, version)
+		self.assertEqual(len(users), len(records))
+		self.assertEqual(users.check(), [])
+		self.assertEqual(list(users.records()), records)
+		for dmr_id, text in records:
+			self.assertEqual(users.lookup(dmr_id), text.split(b","))
+		for dmr_id in [0, 1023000, 1023004, 3100002]:
+			self.assertEqual(users.lookup(dmr_id), None)
+		self.assertEqual(b"".join(users.csv_lines()), csv_data())
+		self.assertEqual(b"".join(users.csv_lines(False)),
+			csv_data(False))
+		self.assertEqual(users.csv_size(), len(csv_data()))
+
+	def check_format(self, version, pooled=False, calls=False):
+		self.write_binary("users.bin", b"", pooled, calls)
+		users = bu.read_binary(self.path("users.bin"))
+		self.check_users(users, version)
+
+		users = bu.map_binary(self.path("users.bin"))
+		try:
+			self.check_users(users, version)
+		finally:
+			users.close()
+
+		self.write_binary("prefixed.bin", b"prefix", pooled, calls)
+		users = bu.map_binary(self.path("prefixed.bin"), len(b"prefix"))
+		try:
+			self.check_users(users, version)
+		finally:
+			users.close()
+
+		self.check_verify("users.bin")
+		return bu.read_binary(self.path("users.bin"))
+
+	# verify accepts the CSV of the records, with or without its header,
+	# and rejects any other
+	def check_verify(self, binary):
+		for data in [csv_data(), csv_data(False)]:
+			self.write("users.csv", data)
+			status, _, err = run_script("binary_users.py",
+				["verify", binary, "users.csv"], self.dir)
+			self.assertEqual(status, 0, err)
+
+		lines = csv_data().splitlines(True)
+		for data, message in [
+				(b"".join(lines[:2] + [b"1023002,K1ABC\n"] + lines[3:]),
+					b"users.csv:3: differs"),
+				(b"".join(lines[:-1]), b"users.csv:7: differs"),
+				(b"".join(lines) + b"3200000,N0CALL,,,,,\n",
+					b"users.csv:8: not in")]:
+			self.write("users.csv", data)
+			status, _, err = run_script("binary_users.py",
+				["verify", binary, "users.csv"], self.dir)
+			self.assertEqual(status, 1)
+			self.assertIn(message, err)
+
+	# merge_users.py writes the same records as a binary userdb as in
+	# its CSV output
+	def check_merge_users(self, args):
+		self.write("in.csv", csv_data(False))
+		for outArgs in [["--output", "out.csv"],
+				args + ["--output", "out.bin"]]:
+			status, _, err = run_script("merge_users.py",
+				outArgs + ["in.csv"], self.dir)
+			self.assertEqual(status, 0, err)
+
+		status, _, err = run_script("binary_users.py",
+			["verify", "out.bin", "out.csv"], self.dir)
+		self.assertEqual(status, 0, err)
+
+	def test_version1(self):
+		users = self.check_format(bu.formatVersion)
+		self.assertFalse(users.pooled)
+		self.assertRaises(ValueError, users.find_call, b"K1ABC")
+		self.check_merge_users(["--binary"])
+
+	def test_pooled(self):
+		users = self.check_format(bu.pooledFormatVersion, pooled=True)
+		self.assertTrue(users.pooled)
+		self.assertEqual(users.codeSize, 2)
+		self.assertEqual(sorted(users.pool_strings()),
+			[b"", b"Austin", b"Berlin", b"DE", b"Dallas", b"TX", b"US"])
+		self.check_merge_users(["--binaryPool"])
+
+	# More than 65536 pooled strings need 4-byte codes
+	def test_pooled_large(self):
+		many = [(1000000 + i, "K{0},Name,City{0},State{0},,Country{0}".format(
+			i).encode("ascii")) for i in range(22000)]
+		out = io.BytesIO()
+		bu.write_binary(out, iter(many), pooled=True)
+		users = bu.BinaryUsers(out.getvalue())
+		self.assertEqual(users.codeSize, 4)
+		self.assertEqual(users.check(), [])
+		self.assertEqual(list(users.records()), many)
+
+	def check_calls(self, users):
+		self.assertEqual(users.callCount, len(records) - 1)
+		self.assertEqual(users.lookup_call(b"k1abc"),
+			[(1023001, records[0][1].split(b",")),
+				(1023002, records[1][1].split(b","))])
+		self.assertEqual([users.id(i) for i in users.find_call(b"K1AB")],
+			[3100000])
+		self.assertEqual([users.id(i) for i in users.find_call(b"w1aw")],
+			[3100001])
+		for call in [b"", b"K1", b"K1ABCD", b"ZZ9ZZ", b"A"]:
+			self.assertEqual(users.find_call(call), [])
+
+	def test_calls(self):
+		users = self.check_format(bu.indexedFormatVersion, calls=True)
+		self.assertFalse(users.pooled)
+		self.check_calls(users)
+		self.check_merge_users(["--binaryCalls"])
+
+	def test_pooled_calls(self):
+		users = self.check_format(bu.indexedFormatVersion, pooled=True,
+			calls=True)
+		self.assertTrue(users.pooled)
+		self.check_calls(users)
+		self.check_merge_users(["--binaryPool", "--binaryCalls"])
+
+	def test_bad_data(self):
+		self.write_binary("users.bin", b"", False, False)
+		file = open(self.path("users.bin"), "rb")
+		data = file.read()
+		file.close()
+		for bad in [data[:bu.headerSize - 1], data[:-1], data + b"x",
+				b"MDUC" + data[4:]]:
+			self.assertRaises(ValueError, bu.BinaryUsers, bad)
+
+		file = open(os.devnull, "wb")
+		try:
+			self.assertRaises(ValueError, bu.write_binary, file,
+				iter(records[1:] + records[:1]))
+		finally:
+			file.close()
+
+if __name__ == '__main__':
+	unittest.main()
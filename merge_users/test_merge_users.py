@@ -0,0 +1,574 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Tests of merge_users.py.  Run them with
+#
+#	python -m unittest discover
+#
+# from this directory, under Python 2 or Python 3.
+
+# MIT License
+#
+# Copyright 2018 Dale Farnsworth
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import bz2
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import load_users
+import merge_users as mu
+
+optionNames = [opt["name"] for opt in mu.optionList]
+
+# Words that the massage steps change, in various cases, and the
+# separators that they treat differently
+fuzzWords = ["AB", "CD", "ab", "JOHN", "John", "SMITH", "Smith", "NORTH",
+	"North", "N", "III", "Iii", "iv", "TEXAS", "Texas", "TX", "ONTARIO",
+	"US", "United", "States", "GERMANY", "Germany", "DE", "(B,", "W1AW",
+	"New", "YORK", "NY", "MC", "Jr", "SOUTH", "Carolina", "CA",
+	"California", "Canada", "Brazil", "x"]
+fuzzSeparators = [" ", "  ", "\t", " \t", "\x0b", ""]
+
+def random_field(rng):
+	n = rng.choice([0, 0, 1, 2, 3, 4, 4, 6])
+	words = [rng.choice(fuzzWords) for _ in range(n)]
+	if n >= 2 and rng.random() < 0.3:
+		words = words[:n // 2] * 2
+
+	field = rng.choice(["", " ", "\t"])
+	for i, word in enumerate(words):
+		field += word
+		if i < n - 1:
+			field += rng.choice(fuzzSeparators)
+	return field + rng.choice(["", " ", "\t"])
+
+# Return the fields of the user after massaging by the compiled massage
+# and by massageSteps
+def massage_both(options, dmr_id, fields):
+	compiled = mu.User(*fields)
+	mu.compile_massage(options)(dmr_id, compiled)
+
+	stepped = mu.User(*fields)
+	for _, step in mu.massageSteps:
+		step(options, dmr_id, stepped)
+
+	return compiled.fields(), stepped.fields()
+
+class CompileMassageTest(unittest.TestCase):
+	def assertSameMassage(self, options, dmr_id, fields):
+		compiled, stepped = massage_both(options, dmr_id, fields)
+		self.assertEqual(compiled, stepped,
+			"{0!r} with {1}".format(fields, sorted(name
+				for name in options if options[name])))
+
+	def test_tabbed_call(self):
+		options = mu.Merger().options
+		fields = ["2000000", "AB\tCD\tAB\tCD", "", "", "", "", ""]
+		compiled, stepped = massage_both(options, 2000000, fields)
+		self.assertEqual(compiled[1], "AB CD")
+		self.assertEqual(compiled, stepped)
+
+	def test_default_options(self):
+		options = mu.Merger().options
+		rng = random.Random(1)
+		for _ in range(2000):
+			dmr_id = rng.choice([5, 999999, 1000000, 3100001])
+			fields = [str(dmr_id)] + [random_field(rng) for _ in range(6)]
+			self.assertSameMassage(options, dmr_id, fields)
+
+	def test_random_options(self):
+		rng = random.Random(2)
+		for _ in range(100):
+			options = dict((name, rng.random() < 0.5)
+				for name in optionNames)
+			for _ in range(100):
+				dmr_id = rng.choice([5, 999999, 1000000, 3100001])
+				fields = [str(dmr_id)] + \
+					[random_field(rng) for _ in range(6)]
+				self.assertSameMassage(options, dmr_id, fields)
+
+class IDRangeTest(unittest.TestCase):
+	def test_parse(self):
+		self.assertEqual(mu.parseIDRange("5"), [5, 5])
+		self.assertEqual(mu.parseIDRange("100-5000"), [100, 5000])
+		self.assertEqual(mu.parseIDRange("x-5000"), None)
+		self.assertEqual(mu.parseIDRange("5000-100"), None)
+
+	def test_reversed(self):
+		merger = mu.Merger()
+		merger.excludeIDRanges("*", ["1-10", "5000-100"], "cfg:3: ")
+		merger.includeIDRanges("*", ["200-199"], "")
+		self.assertEqual(merger.errors, ["cfg:3: bad IDRange 5000-100",
+			"bad IDRange 200-199"])
+
+class CallIndexTest(unittest.TestCase):
+	def setUp(self):
+		calls = [(3100001, "W1AW"), (3100002, "w1aw"), (3100003, "W1AX"),
+			(3100004, "W1A"), (3100005, ""), (3100006, "K1ABC"),
+			(3100007, "W1AW")]
+		self.index = mu.CallIndex((dmr_id, mu.User(str(dmr_id), call))
+			for dmr_id, call in calls)
+
+	def test_lookup(self):
+		self.assertEqual(len(self.index), 4)
+		self.assertEqual(self.index.lookup("w1aw"),
+			[3100001, 3100002, 3100007])
+		self.assertEqual(self.index.lookup("W1A"), [3100004])
+		self.assertEqual(self.index.lookup(""), [])
+		self.assertEqual(self.index.lookup("W1"), [])
+
+	def test_prefix(self):
+		self.assertEqual(self.index.prefix("w1a"), [("W1A", [3100004]),
+			("W1AW", [3100001, 3100002, 3100007]), ("W1AX", [3100003])])
+		self.assertEqual(self.index.prefix("W1A", 2),
+			self.index.prefix("W1A")[:2])
+		self.assertEqual(self.index.prefix("W1AX"), [("W1AX", [3100003])])
+		self.assertEqual(self.index.prefix("W1AY"), [])
+		self.assertEqual(self.index.prefix("X"), [])
+		self.assertEqual([call for call, _ in self.index.prefix("")],
+			["K1ABC", "W1A", "W1AW", "W1AX"])
+
+	def test_search(self):
+		self.assertEqual(self.index.search("w1aw"),
+			[("W1AW", [3100001, 3100002, 3100007])])
+		self.assertEqual(self.index.search("W1A*", 1),
+			[("W1A", [3100004])])
+		self.assertEqual(self.index.search("W1"), [])
+		self.assertEqual(len(self.index.search("*")), 4)
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+testdataDir = os.path.join(testDir, "testdata")
+
+# Run merge_users.py with args in the directory cwd.  Returns its exit
+# status, output and messages.
+def run_merge_users(args, cwd):
+	command = [sys.executable, os.path.join(testDir, "merge_users.py")]
+	proc = subprocess.Popen(command + args, cwd=cwd,
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	out, err = proc.communicate()
+	return proc.returncode, out, err
+
+# A test with a temporary directory, dir, for its files
+class TempDirTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def path(self, name):
+		return os.path.join(self.dir, name)
+
+	def write(self, name, data):
+		path = self.path(name)
+		file = open(path, "wb")
+		file.write(data)
+		file.close()
+		return path
+
+	def read(self, path):
+		file = mu.open_file(path, "rb")
+		try:
+			return file.read()
+		finally:
+			file.close()
+
+	# Run merge_users.py in dir, checking that it succeeds
+	def merge_users(self, args):
+		status, out, err = run_merge_users(args, self.dir)
+		self.assertEqual(status, 0, err)
+		return out
+
+class CompressedInputTest(TempDirTest):
+	def setUp(self):
+		TempDirTest.setUp(self)
+		self.data = b"".join(
+			"{0},W{0},Name {0},City,State,,Country\n".format(
+				3100000 + i).encode("ascii") for i in range(5000))
+
+	def compressed(self, compression):
+		compressor = mu.new_compressor(compression)
+		return compressor.compress(self.data) + compressor.flush()
+
+	def test_whole(self):
+		for compression in ["gzip", "bzip2"]:
+			path = self.write("whole", self.compressed(compression))
+			self.assertEqual(self.read(path), self.data)
+
+	def test_concatenated(self):
+		path = self.write("cat", self.compressed("gzip") * 2)
+		self.assertEqual(self.read(path), self.data * 2)
+
+	def test_truncated(self):
+		for compression in ["gzip", "bzip2"]:
+			data = self.compressed(compression)
+			for size in [len(data) - 1, len(data) // 2]:
+				path = self.write("truncated", data[:size])
+				self.assertRaises(IOError, self.read, path)
+
+	def test_corrupt(self):
+		data = bytearray(bz2.compress(self.data))
+		data[len(data) // 2] ^= 0xff
+		path = self.write("corrupt", bytes(data))
+		self.assertRaises(IOError, self.read, path)
+
+# Return the bytes of a userdb file of n records, with DMR IDs from
+# first and three records for each call sign
+def users_csv(n, first=3100000):
+	return b"".join("{0},K{1}AB,Name {0},City,Texas,,United States\n".format(
+		first + i, i // 3).encode("ascii") for i in range(n))
+
+# Return the records of a CSV output file by DMR ID, skipping its header
+def output_lines(data):
+	lines = data.decode("ascii").splitlines()
+	if lines and "," not in lines[0]:
+		lines = lines[1:]
+	return dict((int(line.split(",", 1)[0]), line) for line in lines)
+
+# Write the output and its lookup index with --output and --index, and
+# look records up in them with lookup --index
+class IndexTest(TempDirTest):
+	def lookup(self, outputFile, keys):
+		out = self.merge_users(["lookup", "--index", outputFile] + keys)
+		return out.decode("ascii").splitlines()
+
+	def check_index(self, n, args):
+		self.write("in.csv", users_csv(n))
+		self.merge_users(args + ["--output", "out.csv", "--index",
+			"in.csv"])
+		lines = output_lines(self.read(self.path("out.csv")))
+		self.assertEqual(len(lines), n)
+
+		for outputFile in ["out.csv", "out.bin"]:
+			if outputFile == "out.bin":
+				self.merge_users(args + ["--binary", "--output",
+					outputFile, "--index", "in.csv"])
+
+			for dmr_id in [3100000, 3100000 + n - 1]:
+				self.assertEqual(self.lookup(outputFile, [str(dmr_id)]),
+					[lines[dmr_id]])
+
+			self.assertEqual(self.lookup(outputFile, ["k0ab"]),
+				[lines[dmr_id] for dmr_id in sorted(lines)
+					if lines[dmr_id].split(",")[1] == "K0AB"])
+
+			prefix = "K1"
+			if n <= 3:
+				prefix = "K"
+			found = self.lookup(outputFile, [prefix + "*"])
+			self.assertEqual(sorted(found),
+				sorted(line for line in lines.values()
+					if line.split(",")[1].startswith(prefix)))
+
+	# The header line is shorter than the magic of a binary userdb
+	def test_small(self):
+		self.check_index(2, [])
+
+	def test_small_no_header(self):
+		self.check_index(2, ["--noHeader"])
+
+	def test_large(self):
+		self.check_index(5000, [])
+
+	def test_large_compressed(self):
+		self.write("in.csv", users_csv(5000))
+		self.merge_users(["--output", "out.csv.gz", "--index", "in.csv"])
+		self.assertEqual(self.lookup("out.csv.gz", ["3104999"]),
+			["3104999,K1666AB,Name 3104999,City,TX,,US"])
+
+	def test_malformed(self):
+		path = self.write("out.csv", b"12\n3100000,A\nabc,B\n")
+		records = mu.output_records(path)
+		self.assertEqual(next(records), (3100000, b"A"))
+		self.assertRaises(mu.MergeError, next, records)
+
+# --sortedInputs merges the files as they are read
+class SortedInputsTest(TempDirTest):
+	def setUp(self):
+		TempDirTest.setUp(self)
+		users = users_csv(20000).splitlines(True)
+		self.write("users.csv", b"".join(users))
+		self.write("over.csv", b"".join(line.replace(b",City,", b",Dallas,")
+			for line in users[::7]))
+		self.write("verbatim.csv", b"".join(line.replace(b"Name", b"Verb")
+			for line in users[5::100]))
+
+	def test_same_output(self):
+		for args in [["users.csv", "over.csv"],
+				["users.csv", "over.csv", "--verbatim", "verbatim.csv"],
+				["users.csv", "--excludeID", "users.csv", "3100010-3100020",
+					"--noHeader"]]:
+			self.assertEqual(self.merge_users(["--sortedInputs"] + args),
+				self.merge_users(args))
+
+	# The output is replaced only by a complete merge
+	def test_unsorted(self):
+		users = users_csv(20000).splitlines(True)
+		users[-2], users[-1] = users[-1], users[-2]
+		self.write("unsorted.csv", b"".join(users))
+		self.write("out.csv", b"old\n")
+		names = sorted(os.listdir(self.dir))
+
+		status, _, err = run_merge_users(["--sortedInputs", "over.csv",
+			"unsorted.csv", "--output", "out.csv"], self.dir)
+		self.assertEqual(status, 1)
+		self.assertIn(b"unsorted.csv:20000 Input not sorted by DMR ID", err)
+		self.assertEqual(sorted(os.listdir(self.dir)), names)
+		self.assertEqual(self.read(self.path("out.csv")), b"old\n")
+
+# Each occurrence of --excludeCountry and --includeCountry applies
+class CountryOptionTest(TempDirTest):
+	def check(self, args, ids):
+		self.write("in.csv", b"".join(
+			"{0},K{0}AB,Name,City,,,{1}\n".format(dmr_id,
+				country).encode("ascii")
+			for dmr_id, country in [(3100001, "United States"),
+				(3100002, "Japan"), (3100003, "Brazil"),
+				(3100004, "Canada")]))
+		out = self.merge_users(["in.csv"] + args)
+		self.assertEqual(sorted(output_lines(out)), ids)
+
+	def test_exclude(self):
+		self.check(["--excludeCountry", "in.csv", "Japan",
+			"--excludeCountry", "*", "Brazil"], [3100001, 3100004])
+
+	def test_include(self):
+		self.check(["--includeCountry", "in.csv", "Japan",
+			"--includeCountry", "in.csv", "Canada"], [3100002, 3100004])
+
+# Rerun --incremental after changing its inputs, comparing its output with
+# a full merge each time
+class IncrementalTest(TempDirTest):
+	def setUp(self):
+		TempDirTest.setUp(self)
+		self.users = users_csv(3000).splitlines(True)
+		self.over = [line.replace(b",City,", b",Dallas,")
+			for line in self.users[::7]]
+		self.verbatim = [self.users[5].replace(b"Name", b"Verbatim")]
+		self.stamp = 0
+
+	# Write the inputs, giving each a later modification time, as a file
+	# changed within the resolution of st_mtime would be taken as unchanged
+	def write_inputs(self):
+		self.stamp += 10
+		for name, lines in [("users.csv", self.users),
+				("over.csv", self.over), ("verbatim.csv", self.verbatim)]:
+			path = self.write(name, b"".join(lines))
+			st = os.stat(path)
+			os.utime(path, (st.st_atime, st.st_mtime + self.stamp))
+
+	def check(self):
+		self.write_inputs()
+		args = ["users.csv", "over.csv", "--verbatim", "verbatim.csv"]
+		self.assertEqual(self.merge_users(["--incremental", "state"] +
+			args), self.merge_users(args))
+
+	def check_changed(self, change):
+		self.check()
+		change()
+		self.check()
+		self.check()
+
+	def test_edit(self):
+		def change():
+			self.users[1000] = self.users[1000].replace(b"City", b"Town")
+			self.over[3] = self.over[3].replace(b"Dallas", b"Austin")
+		self.check_changed(change)
+
+	def test_delete(self):
+		def change():
+			del self.users[2000]
+			del self.over[5]
+			del self.verbatim[0]
+		self.check_changed(change)
+
+	def test_add(self):
+		def change():
+			self.users.append(users_csv(1, 3200000))
+			self.over.append(self.users[10].replace(b"City", b"Plano"))
+			self.verbatim.append(self.users[11])
+		self.check_changed(change)
+
+	# The later of two lines for an ID takes precedence
+	def test_reorder(self):
+		self.over.append(self.users[7].replace(b"City", b"Plano"))
+		def change():
+			self.over[1], self.over[-1] = self.over[-1], self.over[1]
+		self.check_changed(change)
+
+	def test_no_change(self):
+		self.check()
+		self.check()
+		def state_stamp():
+			st = os.stat(self.path("state"))
+			return st.st_ino, st.st_mtime
+
+		stamp = state_stamp()
+		self.merge_users(["--incremental", "state", "users.csv",
+			"over.csv", "--verbatim", "verbatim.csv"])
+		self.assertEqual(state_stamp(), stamp)
+
+# Run merge_users.py serve on a Unix socket, and look records up over it
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs Unix sockets")
+class ServeTest(TempDirTest):
+	def setUp(self):
+		TempDirTest.setUp(self)
+		self.write("users.csv", users_csv(10) + b"bad,line\n")
+		self.socket = self.path("serve.sock")
+		command = [sys.executable, os.path.join(testDir, "merge_users.py"),
+			"serve", "--listen", self.socket, "--reload", "0.1", "-v",
+			"users.csv"]
+		self.proc = subprocess.Popen(command, cwd=self.dir,
+			stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		self.wait(lambda: os.path.exists(self.socket))
+
+	def tearDown(self):
+		if self.proc.poll() == None:
+			self.proc.terminate()
+			self.proc.communicate()
+		TempDirTest.tearDown(self)
+
+	def wait(self, ready):
+		deadline = time.time() + 30
+		while not ready():
+			self.assertEqual(self.proc.poll(), None, "serve exited")
+			self.assertLess(time.time(), deadline, "timed out")
+			time.sleep(0.05)
+
+	# Stop the server, returning the lines it wrote to stderr
+	def stop(self):
+		self.proc.terminate()
+		_, err = self.proc.communicate()
+		return err.decode("utf-8").splitlines()
+
+	def get(self, path):
+		conn = load_users.connection(self.socket, 30)
+		try:
+			conn.request("GET", path)
+			response = conn.getresponse()
+			return response.status, json.loads(
+				response.read().decode("utf-8"))
+		finally:
+			conn.close()
+
+	def test_lookups(self):
+		user = {"id": 3100004, "call": "K1AB", "name": "Name 3100004",
+			"city": "City", "state": "TX", "nick": "", "country": "US"}
+		self.assertEqual(self.get("/id/3100004"), (200, user))
+		self.assertEqual(self.get("/id/3100010")[0], 404)
+		self.assertEqual(self.get("/id/x")[0], 400)
+
+		status, reply = self.get("/call/k1ab")
+		self.assertEqual(status, 200)
+		self.assertEqual(reply["call"], "K1AB")
+		self.assertEqual([u["id"] for u in reply["users"]],
+			[3100003, 3100004, 3100005])
+		self.assertEqual(self.get("/call/K1A")[0], 404)
+
+		status, reply = self.get("/status")
+		self.assertEqual(status, 200)
+		self.assertEqual((reply["records"], reply["generation"],
+			reply["warnings"]), (10, 1, 1))
+		self.assertEqual(self.get("/other")[0], 404)
+
+	# A reload prints a single line, and counts the warnings about the
+	# lines of the files without printing them
+	def test_reload(self):
+		path = self.write("users.csv", users_csv(12) +
+			b"bad,line\nworse,line\n")
+		st = os.stat(path)
+		os.utime(path, (st.st_atime, st.st_mtime + 10))
+		self.wait(lambda: self.get("/status")[1]["generation"] == 2)
+
+		status, reply = self.get("/status")
+		self.assertEqual((reply["records"], reply["warnings"]), (12, 2))
+		self.assertEqual(self.get("/id/3100011")[0], 200)
+
+		lines = self.stop()
+		self.assertEqual(len([line for line in lines
+			if line.startswith("file:")]), 1)
+		self.assertEqual(len([line for line in lines
+			if "Non-numeric" in line]), 1)
+		reloads = [line for line in lines
+			if line.startswith("serve: reloaded")]
+		self.assertEqual(len(reloads), 1)
+		self.assertTrue(reloads[0].endswith(", 2 warnings"), reloads[0])
+
+# Command lines run in testdata.  Their output and messages are
+# compared with testdata/expected/name.out and name.err, which were
+# written by merge_users.py 1.0.3, before it was reworked, running
+# under Python 2.
+differentialCases = [
+	("default", ["in1.csv", "in2.csv", "in3.csv"]),
+	("verbatim", ["in1.csv", "in2.csv", "in3.csv",
+		"--verbatim", "verbatim.csv"]),
+	("noOptions", ["--noAbbrevCountries", "--noAbbrevStates",
+		"--noTitleCase", "--noRemoveMatchingNick", "--noHeader",
+		"--removeNames", "in3.csv", "in1.csv"]),
+	("noMassage", ["--noRemoveRepeats", "--noFixStateCountries",
+		"--noAbbrevDirections", "--noMiscChanges",
+		"--noRemoveCallFromNick", "--noRemoveDupSurnames",
+		"--noFixRomanNumerals", "in1.csv", "in2.csv"]),
+	("obsolete", ["-o", "NoTitleCase", "-o", "NoAbbrevStates",
+		"in2.csv"]),
+	("config", ["--config", "filters.cfg", "in1.csv", "in2.csv",
+		"in3.csv"]),
+	("excludeID", ["in1.csv", "in2.csv", "--excludeID", "in1.csv",
+		"1-3000000", "3100100"]),
+	("excludeCountry", ["in1.csv", "in3.csv", "--excludeCountry",
+		"*", "Japan", "Brazil", "--includeCountry", "in3.csv",
+		"Canada"]),
+]
+
+def read_expected(name):
+	file = open(os.path.join(testdataDir, "expected", name), "rb")
+	try:
+		return file.read()
+	finally:
+		file.close()
+
+# Compare the output of merge_users.py with that of the original on a
+# fixed corpus, with and without worker processes
+class DifferentialTest(unittest.TestCase):
+	def run_case(self, name, args):
+		status, out, err = run_merge_users(args, testdataDir)
+		self.assertEqual(status, 0, err)
+		self.assertEqual(out, read_expected(name + ".out"), name)
+		self.assertEqual(err, read_expected(name + ".err"), name)
+
+	def test_cases(self):
+		for name, args in differentialCases:
+			self.run_case(name, args)
+
+	def test_jobs(self):
+		for name, args in differentialCases:
+			self.run_case(name, ["-j", "2"] + args)
+
+if __name__ == '__main__':
+	unittest.main()